@@ -0,0 +1,230 @@
+import csv
+import os
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import registry
+import storage
+import metrics
+
+# constants
+ALARM_DIR = os.path.join(storage.DATA_DIR, 'alarms')
+# raised and cleared alarms in the order they happened, read by the dashboard
+EVENT_LOG = os.path.join(ALARM_DIR, 'events.csv')
+EVENT_COLUMNS = ['timestamp', 'event', 'kind', 'source', 'value', 'message']
+# rolling state of the detector: the last reading of every sensor and since when it has not changed, when
+# every board last answered, the active alarms and the last poll folded in - saved with every event and
+# every flush of the journal, the samples stored after it are replayed on a restart (see recover)
+STATE_FILE = os.path.join(ALARM_DIR, 'state.json')
+# a threshold alarm clears once the reading is this far back inside its limit, so a reading hovering
+# around the limit does not raise and clear it on every sample
+HYSTERESIS = 1.0
+# readings closer than this count as unchanged for the stuck check - the boards report a tenth of a degree
+STUCK_TOLERANCE = 0.05
+# without a detector in the collector, the dashboard runs one over the samples of the last day
+FALLBACK_WINDOW = timedelta(days=1)
+
+# state of the detector of the collector, loaded on its first poll
+_state = None
+# event log loaded by the app, with the stat of the file it was read from
+_cache_lock = threading.Lock()
+_cache = {'stat': None, 'events': None}
+
+
+# the state of a detector that has not seen a poll yet
+def new_state():
+    return {'sensors': {}, 'boards': {}, 'active': {}}
+
+
+def _minutes_since(at, since):
+    return (at - datetime.fromisoformat(since)).total_seconds() / 60
+
+
+# raise the alarm of kind on source when it is not active yet, or clear it when it is no longer on
+# returns the event, None when nothing changed
+def _toggle(state, at, kind, source, on, value, raised, cleared):
+    key = f"{kind}:{source}"
+    if on == (key in state['active']):
+        return None
+    if on:
+        state['active'][key] = at.isoformat()
+    else:
+        del state['active'][key]
+    return {'timestamp': at.isoformat(), 'event': 'raised' if on else 'cleared', 'kind': kind, 'source': source,
+            'value': round(float(value), 2), 'message': raised if on else cleared}
+
+
+# thresholds, rate of change and stuck readings of a sensor that has a reading
+def _check_sensor(state, sensor, value, at):
+    column, room, limits = sensor['column'], sensor['room'], sensor['alarms']
+    active = state['active']
+    high = value > limits['max'] - (HYSTERESIS if f"high:{column}" in active else 0)
+    low = value < limits['min'] + (HYSTERESIS if f"low:{column}" in active else 0)
+    events = [
+        _toggle(state, at, 'high', column, high, value,
+                f"Alarm for {room}, temperature exceeds {limits['max']}°C ({value:.1f} °C)",
+                f"{room} back below {limits['max']}°C ({value:.1f} °C)"),
+        _toggle(state, at, 'low', column, low, value,
+                f"Alarm for {room}, temperature falls below {limits['min']}°C ({value:.1f} °C)",
+                f"{room} back above {limits['min']}°C ({value:.1f} °C)"),
+    ]
+
+    last = state['sensors'].get(column)
+    if last is None:
+        state['sensors'][column] = {'value': value, 'at': at.isoformat(), 'flat_value': value,
+                                    'flat_since': at.isoformat()}
+        return events
+    # the rate is taken over the time since the last reading, so a gap in the readings is no jump
+    minutes = _minutes_since(at, last['at'])
+    if minutes > 0:
+        rate = abs(value - last['value']) / minutes
+        events.append(_toggle(state, at, 'rate', column, rate > limits['max_rate'], rate,
+                              f"Alarm for {room}, temperature changes by {rate:.1f} °C per minute",
+                              f"{room} changes within {limits['max_rate']} °C per minute again"))
+    # readings are compared with the first of the run, so a slow drift ends it as well
+    if abs(value - last['flat_value']) > STUCK_TOLERANCE:
+        last['flat_value'], last['flat_since'] = value, at.isoformat()
+    flat = _minutes_since(at, last['flat_since'])
+    events.append(_toggle(state, at, 'stuck', column, flat >= limits['stuck_minutes'], value,
+                          f"Alarm for {room}, sensor stuck at {value:.1f} °C for {flat:.0f} minutes",
+                          f"{room} sensor reading changes again ({value:.1f} °C)"))
+    last['value'], last['at'] = value, at.isoformat()
+    return events
+
+
+# a board is offline once none of its sensors had a reading for offline_minutes
+def _check_board(state, board, values, at):
+    seen = state['boards'].setdefault(board['name'], {'seen_at': at.isoformat()})
+    if any(values.get(sensor['column']) is not None for sensor in board['sensors']):
+        seen['seen_at'] = at.isoformat()
+    minutes = _minutes_since(at, seen['seen_at'])
+    return _toggle(state, at, 'offline', board['name'], minutes >= board['alarms']['offline_minutes'], minutes,
+                   f"Alarm for {board['label']}, board offline for {minutes:.0f} minutes",
+                   f"{board['label']} back online")
+
+
+# run the detector over the readings of a poll (column -> value, None for a sensor without reading) taken at
+# at - O(1) per sensor, the state holds all it needs of the previous polls
+# returns the raised and cleared alarms
+def detect(state, values, at):
+    events = []
+    for board in registry.BOARDS:
+        events.append(_check_board(state, board, values, at))
+        for sensor in board['sensors']:
+            value = values.get(sensor['column'])
+            if value is not None:
+                events.extend(_check_sensor(state, sensor, value, at))
+    state['until'] = at.isoformat()
+    return [event for event in events if event]
+
+
+# append events to the log, synced to disk like the samples
+def _append_events(events):
+    os.makedirs(ALARM_DIR, exist_ok=True)
+    is_new = not os.path.exists(EVENT_LOG)
+    with open(EVENT_LOG, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=EVENT_COLUMNS)
+        if is_new:
+            writer.writeheader()
+        writer.writerows(events)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# log events, save the state that raised them and count them
+def _record(events):
+    if events:
+        _append_events(events)
+        save_state()
+    for event in events:
+        print(f"Alarm {event['event']}: {event['message']}")
+        metrics.inc('collector_alarm_events_total', {'kind': event['kind'], 'event': event['event']})
+    metrics.set_gauge('collector_alarms_active', len(_state['active']))
+
+
+# save the state of the detector of the collector - called by the journal with every flush, so the state
+# costs no extra write per poll
+def save_state():
+    if _state is not None:
+        storage.save_json(STATE_FILE, _state)
+
+
+# run the detector of the collector over a poll, whether its sample was stored or not, logging the alarms
+# it raises or clears
+def update(values, at):
+    global _state
+    if _state is None:
+        _state = storage.load_json(STATE_FILE) or new_state()
+    events = detect(_state, values, at)
+    _record(events)
+    return events
+
+
+# the polls of a frame of samples: their time and the reading of every sensor, None when missing
+def _polls(df):
+    readings = df[registry.SENSOR_COLUMNS].to_numpy(dtype=float)
+    for at, row in zip(df['timestamp'], readings):
+        yield at, {col: None if np.isnan(value) else float(value) for col, value in zip(registry.SENSOR_COLUMNS, row)}
+
+
+# bring the detector up to date after a restart, called by the collector before its first poll: the
+# readings of the samples stored after the saved state are replayed - as every event saves the state,
+# they raise nothing the log has already
+# the event log is repaired like the day logs, an event cut short by a power cut is dropped
+def recover():
+    global _state
+    if os.path.exists(EVENT_LOG):
+        storage.repair_log(EVENT_LOG)
+    _state = storage.load_json(STATE_FILE) or new_state()
+    df = storage.load_samples()
+    if not df.empty and 'until' not in _state:
+        # first start of the detector, the history before it is not scanned for alarms
+        _state['until'] = df['timestamp'].iloc[-1].isoformat()
+    elif not df.empty:
+        replay = df.iloc[df['timestamp'].searchsorted(pd.Timestamp(_state['until']), side='right'):]
+        if not replay.empty:
+            print(f"Replaying {len(replay)} samples stored after {_state['until']} into the alarm detector")
+        events = []
+        for at, values in _polls(replay):
+            events.extend(detect(_state, values, at))
+        _record(events)
+    # written once on every start, so the dashboard knows the collector runs the detector
+    save_state()
+
+
+def _events_frame(rows):
+    return storage.parse_rows(pd.DataFrame(rows, columns=EVENT_COLUMNS), EVENT_COLUMNS)
+
+
+# the alarm events logged by the collector, reread when the log changes - None when the collector has
+# not run the detector yet
+def load_events():
+    try:
+        stat = os.stat(EVENT_LOG)
+    except FileNotFoundError:
+        return _events_frame([]) if os.path.exists(STATE_FILE) else None
+    with _cache_lock:
+        if _cache['stat'] != (stat.st_mtime_ns, stat.st_size):
+            _cache['events'] = storage.read_log_lines(EVENT_LOG, 0, EVENT_COLUMNS)[0]
+            _cache['stat'] = (stat.st_mtime_ns, stat.st_size)
+        return _cache['events']
+
+
+# the events a detector raises over the stored samples of the last FALLBACK_WINDOW, for a dashboard
+# without collector - polls that stored no sample are not in there, so a board that stopped answering
+# altogether is not noticed
+def events_from_samples(df):
+    if df.empty:
+        return _events_frame([])
+    recent = df.iloc[df['timestamp'].searchsorted(df['timestamp'].iloc[-1] - FALLBACK_WINDOW):]
+    state, events = new_state(), []
+    for at, values in _polls(recent):
+        events.extend(detect(state, values, at))
+    return _events_frame(events)
+
+
+# the alarms that were raised and not cleared since, most recent first
+def active_alarms(events):
+    last = events.drop_duplicates(['kind', 'source'], keep='last')
+    return last[last['event'] == 'raised'].iloc[::-1]
@@ -0,0 +1,177 @@
+import json
+import os
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import pandas as pd
+import pyarrow as pa
+import registry
+import storage
+import feed
+import rollups
+
+# constants
+# read-only queries over the store of the site, only listening locally by default
+API_HOST = os.getenv('API_HOST', '127.0.0.1')
+API_PORT = int(os.getenv('API_PORT', '8502'))
+RESOLUTIONS = ['raw', *rollups.ROLLUP_LEVELS]
+FORMATS = {'json': 'application/json', 'arrow': 'application/vnd.apache.arrow.stream'}
+# range of a query without start
+DEFAULT_RANGE = timedelta(days=1)
+# columns of every rollup bucket besides the mean, see rollups.ROLLUP_COLUMNS
+ROLLUP_SUFFIXES = ['', '_min', '_max', '_count', '_std']
+# readings are float32 in memory, more decimals in json would only show their rounding
+JSON_DECIMALS = 4
+
+
+# a rejected query, answered with status and message
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_time(value, default):
+    if not value:
+        return default
+    # a + left unencoded in the query arrives as a space, which pandas would silently drop with the offset
+    if ' ' in value.strip():
+        raise QueryError(400, f"Invalid time {value}, separate date and time with T "
+                              "and write the + of an offset as %2B")
+    try:
+        ts = pd.Timestamp(value)
+    except ValueError:
+        raise QueryError(400, f"Invalid time {value}, expected ISO 8601")
+    return ts.tz_localize(storage.ATHENS_TZ) if ts.tzinfo is None else ts.tz_convert(storage.ATHENS_TZ)
+
+
+# the parameters of a samples query: sensor (repeated or comma separated, every sensor of the site by
+# default), start and end (ISO 8601, the last day by default), resolution and format
+def parse_query(query):
+    params = parse_qs(query)
+    columns = [col for value in params.get('sensor', []) for col in value.split(',') if col]
+    columns = columns or registry.SENSOR_COLUMNS
+    unknown = [col for col in columns if col not in rollups.VALUE_COLUMNS]
+    if unknown:
+        raise QueryError(400, f"Unknown sensor {', '.join(unknown)}, see /sensors")
+
+    now = datetime.now(storage.ATHENS_TZ)
+    end = _parse_time(params.get('end', [None])[0], now)
+    start = _parse_time(params.get('start', [None])[0], end - DEFAULT_RANGE)
+    if start > end:
+        raise QueryError(400, "start is after end")
+
+    resolution = params.get('resolution', ['raw'])[0]
+    if resolution not in RESOLUTIONS:
+        raise QueryError(400, f"Unknown resolution {resolution}, expected one of {', '.join(RESOLUTIONS)}")
+    output = params.get('format', ['json'])[0]
+    if output not in FORMATS:
+        raise QueryError(400, f"Unknown format {output}, expected one of {', '.join(FORMATS)}")
+    return columns, start, end, resolution, output
+
+
+# the frame a resolution is answered from and its etag - the etag follows the latest sample, so it only
+# changes when the collector stored a sample (or, for rollups, folded samples into the buckets)
+def load_source(resolution, output):
+    if resolution == 'raw':
+        df = feed.load_samples()
+        if df.empty:
+            raise QueryError(503, "No samples stored yet")
+        version = f"{len(df)}-{df['timestamp'].iloc[-1].value}"
+    else:
+        df = rollups.load_rollup(resolution)
+        if df is None or df.empty:
+            raise QueryError(503, f"No {resolution} rollups written by the collector yet")
+        # the open bucket keeps its start while samples are added to it
+        counts = df.iloc[-1][[f"{col}_count" for col in rollups.VALUE_COLUMNS]]
+        version = f"{len(df)}-{df['timestamp'].iloc[-1].value}-{int(counts.astype(float).fillna(0).sum())}"
+    return df, f'"{resolution}-{version}-{output}"'
+
+
+# the rows between start and end, both included, found by binary search like app.filter_data
+def select(df, columns, start, end, resolution):
+    timestamps = df['timestamp']
+    rows = df.iloc[timestamps.searchsorted(start, side='left'):timestamps.searchsorted(end, side='right')]
+    if resolution != 'raw':
+        columns = [f"{col}{suffix}" for col in columns for suffix in ROLLUP_SUFFIXES]
+    return rows[['timestamp', *columns]]
+
+
+def to_json(df):
+    return df.to_json(orient='records', date_format='iso', date_unit='s', double_precision=JSON_DECIMALS).encode()
+
+
+# an arrow ipc stream, keeping the dtypes of the store (float32 readings, timestamps with their time zone)
+def to_arrow(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# the sensors and weather columns that can be queried
+def describe():
+    sensors = [{'column': sensor['column'], 'room': sensor['room'], 'board': sensor['board']}
+               for sensor in registry.SENSORS]
+    return {'site': registry.SITE_ID, 'name': registry.SITE['name'], 'sensors': sensors,
+            'weather': [col for col in rollups.VALUE_COLUMNS if col not in registry.SENSOR_COLUMNS],
+            'resolutions': RESOLUTIONS, 'formats': list(FORMATS)}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # keep-alive, so a client polling for news reuses its connection
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            if url.path == '/sensors':
+                self._send(200, json.dumps(describe()).encode(), FORMATS['json'])
+            elif url.path == '/samples':
+                self._samples(url.query)
+            else:
+                raise QueryError(404, f"Unknown path {url.path}, expected /samples or /sensors")
+        except QueryError as e:
+            self._send(e.status, json.dumps({'error': str(e)}).encode(), FORMATS['json'])
+        except Exception as e:
+            print(f"Error answering {self.path}: {e}")
+            self._send(500, json.dumps({'error': "Internal error"}).encode(), FORMATS['json'])
+
+    def _samples(self, query):
+        columns, start, end, resolution, output = parse_query(query)
+        df, etag = load_source(resolution, output)
+        # a client polling for news gets a bodiless 304 until the next sample, without filtering or encoding
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self._send(304, b'', None, etag)
+            return
+        rows = select(df, columns, start, end, resolution)
+        body = to_arrow(rows) if output == 'arrow' else to_json(rows)
+        self._send(200, body, FORMATS[output], etag)
+
+    def _send(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+            # the range of a query may end now, so clients revalidate instead of caching for a while
+            self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(host=API_HOST, port=API_PORT):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    print(f"Serving queries of {registry.SITE_ID} on http://{host}:{port}/samples")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,40 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as dt_time
 import plotly.graph_objs as go
 import pytz
-import numpy as np
-from statsmodels.tsa.arima.model import ARIMA
-import os
-from plotly.subplots import make_subplots
-
-CSV_FILE = 'temperature_data.csv'
+import registry
+import storage
+import feed
+import rollups
+import window_stats
+import correlations
+import forecasting
+import profiler
+import alarms
+from downsample import downsample_series
 
 # Athens timezone
 ATHENS_TZ = pytz.timezone('Europe/Athens')
 
+TIME_RANGES = ['Past Week', 'Past 3 Days', 'Past Day', 'Past Month', 'This Heating Season', 'Custom Range']
+# the heating season starts on October 15th and ends on April 30th
+HEATING_SEASON_START = (10, 15)
+HEATING_SEASON_END = (5, 1)
+# seconds between two refreshes of the charts in live mode
+LIVE_REFRESH_SECONDS = 30
+# line and forecast band color of the sensors of a board, in the order of sites.json
+SENSOR_COLORS = [('red', 'rgba(255,0,0,0.12)'), ('blue', 'rgba(0,0,255,0.12)'), ('green', 'rgba(0,128,0,0.12)'),
+                 ('orange', 'rgba(255,165,0,0.12)'), ('purple', 'rgba(128,0,128,0.12)')]
+# sites with more boards pick a single board from a list instead of building a tab for every board
+MAX_BOARD_TABS = 6
+# temperature figures kept for the views shown last, shared by all sessions
+FIGURE_CACHE_ENTRIES = 16
+# points of a temperature figure from which its lines are drawn with webgl
+WEBGL_MIN_POINTS = 2000
+# latest alarm events shown in the alarm log
+ALARM_LOG_ROWS = 20
+
 # detect if user is on a mobile device
 def is_mobile():
     user_agent = st.query_params.get('user_agent', [''])[0]
@@ -20,7 +42,8 @@ def is_mobile():
 
 
 # adjust time shift based on the selected time range and device
-def get_time_shift(time_range):
+# ranges without a tuned shift get a share of the displayed span
+def get_time_shift(time_range, span):
     if is_mobile():
         if time_range == 'Past Week':
             return pd.Timedelta(minutes=800)
@@ -28,6 +51,7 @@ def get_time_shift(time_range):
             return pd.Timedelta(minutes=500)
         elif time_range == 'Past Day':
             return pd.Timedelta(minutes=160)
+        return span * 0.1
     else:
         if time_range == 'Past Week':
             return pd.Timedelta(minutes=500)
@@ -35,101 +59,193 @@ def get_time_shift(time_range):
             return pd.Timedelta(minutes=250)
         elif time_range == 'Past Day':
             return pd.Timedelta(minutes=65)
-        return pd.Timedelta(minutes=0)
+        return span * 0.05
+
+# maximum points per trace sent to the browser, based on the selected time range and device
+def get_point_budget(time_range):
+    if is_mobile():
+        if time_range == 'Past 3 Days':
+            return 400
+        elif time_range == 'Past Day':
+            return 300
+        return 500
+    else:
+        if time_range == 'Past 3 Days':
+            return 1000
+        elif time_range == 'Past Day':
+            return 600
+        return 1500
+
 
 def load_data():
-    # load full dataset
-    if os.path.exists(CSV_FILE):
-        df = pd.read_csv(CSV_FILE)
-        # Convert timestamp to datetime, handling ISO8601 automatically
-        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True, format='ISO8601')
-        df['timestamp'] = df['timestamp'].dt.tz_convert(ATHENS_TZ)
-        return df
-    return pd.DataFrame()
+    # load full dataset from the day segments written by fetch_data, kept up to date from the collector's
+    # shared memory feed - the frame is cached process-wide and shared by all sessions, so it is treated as read-only
+    return feed.load_samples()
 
 
-def filter_data(df, time_range):
+# sunrise and sunset of every day of the loaded data, from the side table kept next to the samples
+def load_sun():
+    return feed.load_sun()
+
+
+# start and end of the selected time range
+# custom_dates are the first and last day picked for 'Custom Range'
+def get_time_bounds(time_range, custom_dates=None):
     now = datetime.now(ATHENS_TZ)
     if time_range == 'Past Week':
-        return df[df['timestamp'] >= now - timedelta(days=7)]
+        return now - timedelta(days=7), now
     elif time_range == 'Past 3 Days':
-        return df[df['timestamp'] >= now - timedelta(days=3)]
+        return now - timedelta(days=3), now
     elif time_range == 'Past Day':
-        return df[df['timestamp'] >= now.replace(hour=0, minute=0, second=0, microsecond=0)]
-    return df
-
-
-# function to check for temperature alarms
-def check_temperature_alarms(df):
-    alarms = []
-    room_pairs = [
-        ('temp_1', 'Rooms 11-12'),
-        ('temp_2', 'Rooms 13-14'),
-        ('temp_3', 'Rooms 15-16'),
-        ('temp_4', 'Rooms 17-18'),
-        ('temp_5', 'Rooms 21-23'),
-        ('temp_6', 'Rooms 24-28')
+        return now.replace(hour=0, minute=0, second=0, microsecond=0), now
+    elif time_range == 'Past Month':
+        return now - timedelta(days=30), now
+    elif time_range == 'This Heating Season':
+        year = now.year if (now.month, now.day) >= HEATING_SEASON_START else now.year - 1
+        start = ATHENS_TZ.localize(datetime(year, *HEATING_SEASON_START))
+        end = ATHENS_TZ.localize(datetime(year + 1, *HEATING_SEASON_END))
+        return start, min(now, end)
+    elif time_range == 'Custom Range' and custom_dates:
+        first_day, last_day = custom_dates[0], custom_dates[-1]
+        start = ATHENS_TZ.localize(datetime.combine(first_day, dt_time()))
+        end = ATHENS_TZ.localize(datetime.combine(last_day + timedelta(days=1), dt_time()))
+        return start, min(now, end)
+    return now - timedelta(days=7), now
+
+
+# pick the finest resolution with no more rows than the point budget of the charts: the raw samples, or a
+# rollup level, whose buckets are drawn as the envelope of their minimum and maximum (see downsample_series) -
+# the coarsest level for a range too long for any
+def get_resolution(start, end, max_points):
+    span = (end - start).total_seconds()
+    if span / registry.SAMPLE_INTERVAL <= max_points:
+        return 'raw'
+    for level, seconds in rollups.ROLLUP_LEVELS.items():
+        if span / seconds <= max_points:
+            return level
+    return list(rollups.ROLLUP_LEVELS)[-1]
+
+
+# data for the charts of a time range - the raw samples or, for long ranges, a rollup of them
+def load_view(df, start, end, max_points):
+    resolution = get_resolution(start, end, max_points)
+    if resolution == 'raw':
+        return df
+    view = rollups.load_rollup(resolution)
+    # fall back to raw samples until the collector has produced rollups
+    if view is None or view.empty:
+        return df
+    return view
+
+
+# slice the rows from start until end - the data is sorted by timestamp, so a binary search
+# finds the range in O(log n) instead of masking every row
+# end is exclusive, a custom range ends at the midnight after its last day
+def filter_data(df, start, end):
+    timestamps = df['timestamp']
+    first = timestamps.searchsorted(start, side='left')
+    last = timestamps.searchsorted(end, side='left')
+    return df.iloc[first:last]
+
+
+# identify the loaded data, so results derived from it can be cached until a new sample arrives
+def get_data_version(df):
+    if df.empty:
+        return 0, 0
+    return len(df), df['timestamp'].iloc[-1].value
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def compute_alarm_events(data_version, _df):
+    return alarms.events_from_samples(_df)
+
+
+# alarm events - raised and cleared by the detector of the collector as the samples come in, only detected
+# over the last samples when the collector has not run its detector yet
+def get_alarm_events(df):
+    events = alarms.load_events()
+    if events is None:
+        events = compute_alarm_events(get_data_version(df), df)
+    return events
+
+
+# statistics per sensor of the data shown for the selected time range, merged from the rollup
+# buckets when the view is a rollup
+def get_window_stats(view_df):
+    if f"{storage.SENSOR_COLUMNS[0]}_count" in view_df:
+        return window_stats.stats_from_rollup(view_df)
+    return window_stats.stats_from_samples(view_df)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def compute_correlation_sums(data_version, start, end, _df):
+    return correlations.sums_from_samples(filter_data(_df, start, end))
+
+
+# correlation matrix of the samples between start and end - summed from the co-moment blocks of the
+# collector, only computed from the samples when the collector has not written any yet
+def get_correlation_matrix(df, start, end):
+    sums = correlations.load_sums(start, end)
+    if sums is None:
+        sums = compute_correlation_sums(get_data_version(df), start, end, df)
+    return correlations.correlation_matrix(sums)
+
+
+# daylight interval of every day in the data, in a single pass over the samples and the per-day sun table:
+# from the first to the last sample taken between sunrise and sunset
+@st.cache_data(max_entries=4, show_spinner=False)
+def compute_daylight_intervals(data_version, _df, _sun):
+    if _sun.empty:
+        return pd.DataFrame(columns=['x0', 'x1'])
+
+    # compare as plain UTC datetime64 values, tz-aware comparisons would box every row
+    days = _df['timestamp'].dt.normalize()
+    timestamps = _df['timestamp'].to_numpy('datetime64[ns]')
+    sunrise = _sun['sunrise'].reindex(days).to_numpy('datetime64[ns]')
+    sunset = _sun['sunset'].reindex(days).to_numpy('datetime64[ns]')
+    in_daylight = (timestamps >= sunrise) & (timestamps <= sunset)
+
+    daylight = _df['timestamp'][in_daylight].groupby(days[in_daylight])
+    return pd.DataFrame({'x0': daylight.min(), 'x1': daylight.max()})
+
+
+# the last reading of every sensor between start and end of the raw samples df and its time, also for the
+# charts of a rollup - sensors without a reading in the range are left out
+def get_last_readings(df, start, end):
+    rows = filter_data(df, start, end)
+    readings = {}
+    for col in storage.SENSOR_COLUMNS:
+        present = rows[col].notna().to_numpy().nonzero()[0]
+        if len(present):
+            readings[col] = (rows['timestamp'].iloc[present[-1]], rows[col].iloc[present[-1]])
+    return readings
+
+
+# translucent rectangles for the daylight between start and end, shared by all temperature figures
+def get_sun_shapes(df, start, end):
+    intervals = compute_daylight_intervals(get_data_version(df), df, load_sun())
+    intervals = intervals[(intervals['x1'] >= start) & (intervals['x0'] <= end)]
+    return [
+        dict(
+            type="rect",
+            x0=max(x0, start),
+            x1=min(x1, end),
+            xref='x',
+            y0=0,
+            y1=1,
+            yref='paper',  # span the whole plot height, so the same shapes fit every figure
+            fillcolor="yellow",
+            opacity=0.15,  # keep the overlay subtle
+            line_width=0,
+            layer='below'  # place it behind the temperature lines
+        )
+        for x0, x1 in zip(intervals['x0'], intervals['x1'])
     ]
 
-    for temp_column, room_name in room_pairs:
-        if df[temp_column].max() > 100:
-            alarms.append(f"Alarm for {room_name}, temperature exceeds 100°C")
-        if df[temp_column].min() < 20:
-            alarms.append(f"Alarm for {room_name}, temperature falls below 20°C")
-
-    return alarms
-
-
-def add_sun_overlay(fig, df):
-    # hardcoded sunrise and sunset times
-    sunrise_time = "06:41"
-    sunset_time = "17:19"
-
-    # define the Athens time zone
-    athens_tz = pytz.timezone("Europe/Athens")
-
-    # convert the range of timestamps in the dataframe to the Athens time zone
-    min_timestamp = pd.to_datetime(df['timestamp'].min()).tz_convert(athens_tz)
-    max_timestamp = pd.to_datetime(df['timestamp'].max()).tz_convert(athens_tz)
-
-    # get unique days from the timestamp column and convert them to Athens time
-    unique_days = pd.to_datetime(df['timestamp']).dt.tz_convert(athens_tz).dt.date.unique()
-
-    # find the min and max temperature values for setting the overlay height
-    y_min = df[['temp_1', 'temp_2', 'temp_3', 'temp_4', 'temp_5', 'temp_6']].min().min()
-    y_max = df[['temp_1', 'temp_2', 'temp_3', 'temp_4', 'temp_5', 'temp_6']].max().max()
-
-    for day in unique_days:
-        # make datetime objects for sunrise and sunset in Athens time
-        sunrise = athens_tz.localize(pd.Timestamp(f"{day} {sunrise_time}"))
-        sunset = athens_tz.localize(pd.Timestamp(f"{day} {sunset_time}"))
-
-        # filter data for the current day
-        day_data = df[(df['timestamp'] >= sunrise) & (df['timestamp'] <= sunset)]
-
-        if not day_data.empty:
-            # get the first and last timestamp for the current day in the data
-            oldest_timestamp = day_data['timestamp'].min().tz_convert(athens_tz)
-            latest_timestamp = day_data['timestamp'].max().tz_convert(athens_tz)
-
-            # adjust sunrise and sunset times based on the data
-            if oldest_timestamp > sunrise:
-                sunrise = oldest_timestamp  # start the overlay from the first data point
-            if latest_timestamp < sunset:
-                sunset = latest_timestamp  # end the overlay at the last data point
-
-            # add the translucent yellow rectangle for the sun overlay
-            fig.add_shape(
-                type="rect",
-                x0=sunrise,
-                y0=y_min,
-                x1=sunset,
-                y1=y_max,
-                fillcolor="yellow",
-                opacity=0.15,  # keep the overlay subtle
-                line_width=0,
-                layer='below'  # place it behind the temperature lines
-            )
+
+def add_sun_overlay(fig, sun_shapes):
+    # add all daylight rectangles in one layout update instead of one add_shape call per day
+    fig.update_layout(shapes=sun_shapes)
 
     # add a dummy trace for the legend to indicate sunlight
     fig.add_trace(
@@ -145,25 +261,37 @@ def add_sun_overlay(fig, df):
     # return the updated figure
     return fig
 
-def plot_correlations(df):
-    # Mapping temperature columns to room names
-    room_pairs = [
-        ('temp_1', 'Rooms 11-12'),
-        ('temp_2', 'Rooms 13-14'),
-        ('temp_3', 'Rooms 15-16'),
-        ('temp_4', 'Rooms 17-18'),
-        ('temp_5', 'Rooms 21-23'),
-        ('temp_6', 'Rooms 24-28')
-    ]
 
-    # Create a dictionary to map temp columns to room names
-    temp_to_room_map = {temp: room for temp, room in room_pairs}
+# add the forecast of the background worker to a figure: the expected temperature as a dotted line
+# in the color of the sensor, inside a band of the likely outcomes - only the first forecast of a figure
+# gets a legend entry
+def add_forecast_overlay(fig, forecast, color, band_color, showlegend=True):
+    timestamps = pd.to_datetime(forecast['timestamp'], format='ISO8601')
+    fig.add_trace(go.Scatter(x=timestamps, y=forecast['upper'], mode='lines', line=dict(width=0),
+                             hoverinfo='skip', showlegend=False))
+    fig.add_trace(go.Scatter(x=timestamps, y=forecast['lower'], mode='lines', line=dict(width=0),
+                             fill='tonexty', fillcolor=band_color, hoverinfo='skip', showlegend=False))
+    fig.add_trace(go.Scatter(x=timestamps, y=forecast['mean'], mode='lines', name='Forecast',
+                             line=dict(color=color, dash='dot'), showlegend=showlegend))
+    return fig
+
+# containers for the charts of the site's boards - a tab per board, or for sites with many boards a list
+# to pick one from, so only the charts of that board are built and sent
+def board_containers(key):
+    if len(registry.BOARDS) <= MAX_BOARD_TABS:
+        return list(zip(registry.BOARDS, st.tabs([board['label'] for board in registry.BOARDS])))
+    labels = [board['label'] for board in registry.BOARDS]
+    label = st.selectbox("Board", labels, key=key)
+    return [(registry.BOARDS[labels.index(label)], st.container())]
 
+
+def plot_correlations(df, start, end):
     # Correlation matrix for all boiler temperatures
-    corr_matrix = df[['temp_1', 'temp_2', 'temp_3', 'temp_4', 'temp_5', 'temp_6']].corr()
+    temp_columns = storage.SENSOR_COLUMNS
+    corr_matrix = get_correlation_matrix(df, start, end).loc[temp_columns, temp_columns]
 
     # Rename the index and columns of the correlation matrix using the room names
-    corr_matrix.rename(index=temp_to_room_map, columns=temp_to_room_map, inplace=True)
+    corr_matrix = corr_matrix.rename(index=registry.ROOMS, columns=registry.ROOMS)
 
     # Create the heatmap (keep the original order)
     fig_corr_matrix = go.Figure(data=go.Heatmap(
@@ -176,116 +304,113 @@ def plot_correlations(df):
     # Adjust layout to minimize empty space
     fig_corr_matrix.update_layout(
         margin=dict(l=20, r=20, t=20, b=20),  # Reduce margins to minimize empty space
-        xaxis_nticks=36  # Increase the number of x-axis ticks if needed
+        xaxis_nticks=36,  # Increase the number of x-axis ticks if needed
+        height=max(450, 20 * len(temp_columns))  # keep a row per room readable on sites with many sensors
     )
 
     # Display the heatmap with the updated settings
     st.subheader("Boiler Temperature Correlation Matrix", help="(Pearson Correlation)")
-    st.plotly_chart(fig_corr_matrix, use_container_width=True)
-
-
-def plot_temperatures(df, time_range, overkill_mode, unfiltered_df):
-    if not df.empty:
-        # Define layout properties with centering for legends
-        common_layout = dict(
-            autosize=True,
-            plot_bgcolor='rgba(0,0,0,0)',  # Transparent background
-            font=dict(size=12),             # Responsive font size
-            showlegend=True,                # Enable legends for each plot
-            legend=dict(
-                orientation="h",            # Horizontal legend
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
-            xaxis=dict(title_font=dict(size=14), automargin=True),  # X-axis title with auto margins
-            yaxis=dict(title_font=dict(size=14), automargin=True),  # Y-axis title with auto margins
-            margin=dict(l=20, r=20, t=40, b=40),  # Tighter margins
-            height=380
-        )
-
-
-        # Create figures for each room pair
-        fig1 = go.Figure()
-        fig1.add_trace(
-            go.Scatter(x=df['timestamp'], y=df['temp_1'], mode='lines', name='Rooms 11-12', line=dict(color='red'))
-        )
-        fig1.add_trace(
-            go.Scatter(x=df['timestamp'], y=df['temp_2'], mode='lines', name='Rooms 13-14', line=dict(color='blue'))
-        )
-        fig1.update_layout(
-            xaxis_title="Date",
-            yaxis_title="Temperature (°C)",
-            **common_layout
-        )
-
-        fig2 = go.Figure()
-        fig2.add_trace(
-            go.Scatter(x=df['timestamp'], y=df['temp_3'], mode='lines', name='Rooms 15-16', line=dict(color='red'))
-        )
-        fig2.add_trace(
-            go.Scatter(x=df['timestamp'], y=df['temp_4'], mode='lines', name='Rooms 17-18', line=dict(color='blue'))
-        )
-        fig2.update_layout(
-            xaxis_title="Date",
-            yaxis_title="Temperature (°C)",
-            **common_layout
-        )
+    profiler.plotly_chart(fig_corr_matrix, use_container_width=True)
+
+
+# line and band colors of the sensors of a board
+def colors_of(board):
+    return [SENSOR_COLORS[index % len(SENSOR_COLORS)] for index in range(len(board['sensors']))]
+
+
+# the temperature figures of the given boards, built once per view and shared by every session showing it -
+# the hashed arguments identify what they show, the underscored ones are only read to build them: view is
+# the rows of _df, mobile and board_names only key the cache, as the time shift and point budget ask for
+# the device class themselves, while _start and _end are fixed by the view and the data version
+# traces are the downsampled series per sensor, they are computed from _df unless given (see update_live_traces)
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def build_temperature_figures(data_version, view, time_range, overkill_mode, mobile, board_names, forecasts,
+                              _boards, _df, _unfiltered_df, _start, _end, _traces=None):
+    # Define layout properties with centering for legends
+    common_layout = dict(
+        autosize=True,
+        plot_bgcolor='rgba(0,0,0,0)',  # Transparent background
+        font=dict(size=12),             # Responsive font size
+        showlegend=True,                # Enable legends for each plot
+        legend=dict(
+            orientation="h",            # Horizontal legend
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        xaxis=dict(title_font=dict(size=14), automargin=True),  # X-axis title with auto margins
+        yaxis=dict(title_font=dict(size=14), automargin=True),  # Y-axis title with auto margins
+        margin=dict(l=20, r=20, t=40, b=40),  # Tighter margins
+        height=380
+    )
 
-        fig3 = go.Figure()
-        fig3.add_trace(
-            go.Scatter(x=df['timestamp'], y=df['temp_5'], mode='lines', name='Rooms 21-23', line=dict(color='red'))
-        )
-        fig3.add_trace(
-            go.Scatter(x=df['timestamp'], y=df['temp_6'], mode='lines', name='Rooms 24-28', line=dict(color='blue'))
-        )
-        fig3.update_layout(
+    # downsample the series of the boards to the point budget before building the figures
+    # given traces are completed in place, so live mode keeps them for its next refresh
+    traces = {} if _traces is None else _traces
+    missing = [sensor['column'] for board in _boards for sensor in board['sensors'] if sensor['column'] not in traces]
+    if missing:
+        max_points = get_point_budget(time_range)
+        with profiler.stage('downsample'):
+            traces.update({col: downsample_series(_df, col, max_points) for col in missing})
+
+    # Get the time shift for the current time range
+    time_shift = get_time_shift(time_range, _df['timestamp'].iloc[-1] - _df['timestamp'].iloc[0])
+
+    # annotate the last raw reading of the range, even when the charts show a rollup - a range that ended in
+    # the past shows its own last readings, not the current ones
+    readings = get_last_readings(_unfiltered_df, _start, _end)
+
+    # Create a figure for the rooms of each board
+    figures = []
+    for board in _boards:
+        fig = go.Figure()
+        # long series are drawn with webgl, which stays smooth where svg paths get sluggish
+        points = sum(len(traces[sensor['column']][0]) for sensor in board['sensors'])
+        scatter = go.Scattergl if points >= WEBGL_MIN_POINTS else go.Scatter
+        for sensor, (color, _) in zip(board['sensors'], colors_of(board)):
+            col = sensor['column']
+            # plotly.js draws the local time of a date and ignores its offset, so the lines get plain local
+            # datetime64 values to the second - the figure is serialized on every rerun, and they take a fraction
+            # of the time (and bytes) of tz-aware datetime objects
+            x, y = traces[col]
+            fig.add_trace(
+                scatter(x=x.dt.tz_localize(None).to_numpy().astype('datetime64[s]'), y=y.to_numpy(), mode='lines',
+                        name=sensor['room'], line=dict(color=color))
+            )
+            if col in readings:
+                at, value = readings[col]
+                fig.add_annotation(
+                    x=at + time_shift,
+                    y=value,
+                    text=f"{value:.1f} °C", showarrow=False, font=dict(color=color)
+                )
+        fig.update_layout(
             xaxis_title="Date",
             yaxis_title="Temperature (°C)",
             **common_layout
         )
-
-        # Get the time shift for the current time range
-        time_shift = get_time_shift(time_range)
-
-        # Add annotations with time shift only if overkill mode is not activated
-        fig1.add_annotation(
-            x=df['timestamp'].iloc[-1] + time_shift,
-            y=df['temp_1'].iloc[-1],
-            text=f"{df['temp_1'].iloc[-1]:.1f} °C", showarrow=False, font=dict(color='red')
-        )
-        fig1.add_annotation(
-            x=df['timestamp'].iloc[-1] + time_shift,
-            y=df['temp_2'].iloc[-1],
-            text=f"{df['temp_2'].iloc[-1]:.1f} °C", showarrow=False, font=dict(color='blue')
-        )
-        fig2.add_annotation(
-            x=df['timestamp'].iloc[-1] + time_shift,
-            y=df['temp_3'].iloc[-1],
-            text=f"{df['temp_3'].iloc[-1]:.1f} °C", showarrow=False, font=dict(color='red')
-        )
-        fig2.add_annotation(
-            x=df['timestamp'].iloc[-1] + time_shift,
-            y=df['temp_4'].iloc[-1],
-            text=f"{df['temp_4'].iloc[-1]:.1f} °C", showarrow=False, font=dict(color='blue')
-        )
-        fig3.add_annotation(
-            x=df['timestamp'].iloc[-1] + time_shift,
-            y=df['temp_5'].iloc[-1],
-            text=f"{df['temp_5'].iloc[-1]:.1f} °C", showarrow=False, font=dict(color='red')
-        )
-        fig3.add_annotation(
-            x=df['timestamp'].iloc[-1] + time_shift,
-            y=df['temp_6'].iloc[-1],
-            text=f"{df['temp_6'].iloc[-1]:.1f} °C", showarrow=False, font=dict(color='blue')
-        )
-
-        # if overkill, add sun overlay and forecasted temperatures
-        if overkill_mode:
-            for fig in [fig1, fig2, fig3]:
-                fig = add_sun_overlay(fig, df)
-
+        figures.append(fig)
+
+    # if overkill, add sun overlay and forecasted temperatures
+    if overkill_mode:
+        with profiler.stage('add_sun_overlay'):
+            sun_shapes = get_sun_shapes(_unfiltered_df, _df['timestamp'].iloc[0], _df['timestamp'].iloc[-1])
+            for fig in figures:
+                add_sun_overlay(fig, sun_shapes)
+        if forecasts:
+            with profiler.stage('add_forecast_overlay'):
+                for board, fig in zip(_boards, figures):
+                    shown = [(sensor['column'], colors) for sensor, colors in zip(board['sensors'], colors_of(board))
+                             if sensor['column'] in forecasts]
+                    for index, (col, (color, band_color)) in enumerate(shown):
+                        add_forecast_overlay(fig, forecasts[col], color, band_color, showlegend=index == 0)
+    return figures
+
+
+# traces are the downsampled series per sensor, they are computed from df unless given (see update_live_traces)
+def plot_temperatures(df, start, end, time_range, overkill_mode, unfiltered_df, forecasts=None, traces=None):
+    if not df.empty:
         # Plotly chart configuration to hide toolbar and disable zoom on mobile
         config = {
             'displayModeBar': False,  # Disable the toolbar
@@ -295,13 +420,20 @@ def plot_temperatures(df, time_range, overkill_mode, unfiltered_df):
         }
 
         # create tabs to choose rooms
-        tab1, tab2, tab3 = st.tabs(["Rooms 11-14", "15-18", "21-28"])
-        with tab1:
-            st.plotly_chart(fig1, use_container_width=True, config=config)
-        with tab2:
-            st.plotly_chart(fig2, use_container_width=True, config=config)
-        with tab3:
-            st.plotly_chart(fig3, use_container_width=True, config=config)
+        containers = board_containers('temperature_board')
+        boards = [board for board, _ in containers]
+
+        # the figures only change with a new sample, another view or another device class - a rerun for any
+        # other widget of the page takes them from the cache
+        view = (len(df), df['timestamp'].iloc[0].value, df['timestamp'].iloc[-1].value)
+        with profiler.stage('build_figures'):
+            figures = build_temperature_figures(get_data_version(unfiltered_df), view, time_range, overkill_mode,
+                                                is_mobile(), [board['name'] for board in boards], forecasts,
+                                                boards, df, unfiltered_df, start, end, traces)
+
+        for fig, (_, container) in zip(figures, containers):
+            with container:
+                profiler.plotly_chart(fig, use_container_width=True, config=config)
 
     else:
         st.write("No data available.")
@@ -321,12 +453,8 @@ def calculate_sunlight_remaining(sunrise, sunset):
 
 
 def plot_correlation_gauges(df):
-    # Define room names and corresponding temperature columns in groups of two
-    room_pairs = [
-        [('temp_1', 'Rooms 11-12'), ('temp_2', 'Rooms 13-14')],
-        [('temp_3', 'Rooms 15-16'), ('temp_4', 'Rooms 17-18')],
-        [('temp_5', 'Rooms 21-23'), ('temp_6', 'Rooms 24-28')]
-    ]
+    # only needed for the gauges of Advanced Mode, so it is not imported on the startup path
+    from plotly.subplots import make_subplots
 
     st.subheader("Correlation Gauges")
     # Create a selectbox for choosing the correlation type
@@ -340,21 +468,27 @@ def plot_correlation_gauges(df):
     correlation_column = (
         'current_cloudiness' if correlation_type == "Boiler Temp. vs Cloud Coverage" else 'current_temp'
     )
-
-    # Create tabs to choose room groups
-    tabs = st.tabs(["Rooms 11-14", "Rooms 15-18", "Rooms 21-28"])
-
-    for tab, pairs in zip(tabs, room_pairs):
-        with tab:
-            # Create a 1x2 layout for the gauges
+    # the boilers react to the weather with a delay, so the weather can be taken some hours earlier
+    lag = st.select_slider("Weather taken", options=[0, *correlations.LAG_HOURS],
+                           format_func=lambda hours: f"{hours} h earlier" if hours else "at the same time")
+    if lag:
+        correlation_column = correlations.lagged_column(correlation_column, lag)
+    corr_matrix = get_correlation_matrix(df, df['timestamp'].iloc[0], df['timestamp'].iloc[-1])
+
+    # Create tabs to choose the board of the rooms
+    for board, container in board_containers('gauge_board'):
+        with container:
+            # Create a 1xN layout with a gauge per room of the board
+            sensors = board['sensors']
             fig = make_subplots(
-                rows=1, cols=2,
-                specs=[[{'type': 'indicator'}, {'type': 'indicator'}]],
-                horizontal_spacing=0.2
+                rows=1, cols=len(sensors),
+                specs=[[{'type': 'indicator'}] * len(sensors)],
+                horizontal_spacing=0.2 if len(sensors) <= 2 else 0.1
             )
             # Add gauges to the figure
-            for idx, (temp_col, room_name) in enumerate(pairs):
-                correlation = df[temp_col].corr(df[correlation_column])
+            for idx, sensor in enumerate(sensors):
+                room_name = sensor['room']
+                correlation = corr_matrix.loc[sensor['column'], correlation_column]
                 fig.add_trace(
                     go.Indicator(
                         mode="gauge+number",
@@ -374,28 +508,30 @@ def plot_correlation_gauges(df):
                 )
             # Update layout and display the figure
             fig.update_layout(height=300, width=700, showlegend=False)
-            st.plotly_chart(fig, use_container_width=True)
+            profiler.plotly_chart(fig, use_container_width=True)
 
 import streamlit as st
 import pandas as pd
 
-# function to calculate metrics for each boiler using a loop
-def calculate_metrics_per_boiler(df):
-    rooms = ['Rooms 11-12', 'Rooms 13-14', 'Rooms 15-16', 'Rooms 17-18', 'Rooms 21-23', 'Rooms 24-28']
-    temp_columns = ['temp_1', 'temp_2', 'temp_3', 'temp_4', 'temp_5', 'temp_6']
+# function to calculate metrics for each boiler from its statistics, using a loop
+def calculate_metrics_per_boiler(stats, latest):
+    temp_columns = storage.SENSOR_COLUMNS
+    rooms = [registry.ROOMS[col] for col in temp_columns]
 
     # prepare lists to store each metric
     std_list, mean_list, min_list, max_list, current_list, trend_list = [], [], [], [], [], []
 
     for col in temp_columns:
-        std_list.append(round(df[col].std(), 2))
-        mean_list.append(round(df[col].mean(), 2))
-        min_list.append(round(df[col].min(), 2))
-        max_list.append(round(df[col].max(), 2))
-        current_list.append(round(df[col].iloc[-1], 2))
+        acc = stats[col]
+        mean = acc['mean'] if acc['count'] else float('nan')
+        std_list.append(round(window_stats.accumulator_std(acc), 2))
+        mean_list.append(round(mean, 2))
+        min_list.append(round(acc['min'], 2) if acc['min'] is not None else float('nan'))
+        max_list.append(round(acc['max'], 2) if acc['max'] is not None else float('nan'))
+        current_list.append(round(latest[col], 2))
 
         # calculate trend: positive if last value > mean, negative otherwise
-        trend = "Up" if df[col].iloc[-1] > df[col].mean() else "Down"
+        trend = "Up" if latest[col] > mean else "Down"
         trend_list.append(trend)
 
     # create a DataFrame with all metrics
@@ -410,6 +546,49 @@ def calculate_metrics_per_boiler(df):
     }
     return pd.DataFrame(metrics_data)
 
+# forecasts continue the charts into the future, so they are only shown for ranges ending now
+def get_forecasts(overkill_mode, end):
+    if overkill_mode and end >= datetime.now(ATHENS_TZ) - timedelta(minutes=5):
+        return forecasting.load_forecasts()
+    return None
+
+
+# chart traces of the live view - the traces of the last refresh are kept in the session and only the rows
+# that arrived since are appended, instead of downsampling the whole range again
+def update_live_traces(view_df, view_key, max_points):
+    live = st.session_state.get('live_traces')
+    timestamps = view_df['timestamp']
+    # the last row seen is taken again, as a rollup's open bucket keeps changing until it closes
+    new_rows = view_df.iloc[timestamps.searchsorted(live['seen']):] if live is not None else view_df
+    # otherwise plot_temperatures downsamples the series of the boards it shows - also when the view no
+    # longer reaches the last row seen, e.g. a rollup lagging behind the samples by a journal batch
+    traces = {}
+    if not (live is None or live['key'] != view_key or new_rows.empty
+            or any(len(x) > 2 * max_points for x, _ in live['traces'].values())):
+        for col, (x, y) in live['traces'].items():
+            keep = ((x >= timestamps.iloc[0]) & (x < new_rows['timestamp'].iloc[0])).to_numpy()
+            # all of the new rows, the buckets of a rollup as their minimum and maximum
+            new_x, new_y = downsample_series(new_rows, col, 2 * len(new_rows))
+            traces[col] = (pd.concat([x[keep], new_x]), pd.concat([y[keep], new_y]))
+    if not timestamps.empty:
+        st.session_state['live_traces'] = {'key': view_key, 'seen': timestamps.iloc[-1], 'traces': traces}
+    return traces
+
+
+# the temperature charts in live mode: only this fragment reruns on every refresh, the rest of the page stays
+# as it is - when no sample arrived the figures are identical, and streamlit only sends a reference to them
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_temperatures(time_range, custom_dates, overkill_mode):
+    df = load_data()
+    start, end = get_time_bounds(time_range, custom_dates)
+    max_points = get_point_budget(time_range)
+    view_df = filter_data(load_view(df, start, end, max_points), start, end)
+    # the resolution can change as the range grows, the traces of raw samples and of a rollup do not mix
+    view_key = (time_range, custom_dates, overkill_mode, get_resolution(start, end, max_points))
+    traces = update_live_traces(view_df, view_key, max_points)
+    plot_temperatures(view_df, start, end, time_range, overkill_mode, df, get_forecasts(overkill_mode, end), traces)
+
+
 def main():
     st.set_page_config(page_title="Boiler Temp")
 
@@ -443,18 +622,22 @@ def main():
         unsafe_allow_html=True
     )
     st.title("Boiler Temperature Monitoring")
+    if len(registry.SITES) > 1:
+        st.caption(registry.SITE['name'])
+    profiler.start_run()
 
     # load data
-    df = load_data()
+    with profiler.stage('load_data'):
+        df = load_data()
 
     # display weather data if available
     if not df.empty:
-        latest_data = df.iloc[-1]  # most recent data
+        latest_data = df.iloc[-1].fillna(float('nan'))  # most recent data, missing weather as NaN
         current_temp = latest_data['current_temp']
         current_humidity = latest_data['current_humidity']
         current_cloudiness = latest_data['current_cloudiness']
-        current_sunrise = pd.to_datetime(latest_data['current_sunrise'])
-        current_sunset = pd.to_datetime(latest_data['current_sunset'])
+        sun = load_sun()
+        current_sunrise, current_sunset = sun.iloc[-1] if not sun.empty else (pd.NaT, pd.NaT)
         three_day_forecast_avg = latest_data.get('three_day_forecast_avg', 'N/A')
         sunlight_remaining = calculate_sunlight_remaining(current_sunrise, current_sunset)
 
@@ -519,35 +702,58 @@ def main():
 
             # Weather Forecast Link
             st.markdown(
-                "<h4 style='text-align: center;margin: 0;'><a href='https://openweathermap.org/city/263824' target='_blank' style='text-decoration: none;'>Weather Forecast Agios Nikolaos</a></h4>",
+                f"<h4 style='text-align: center;margin: 0;'><a href='https://openweathermap.org/city/{registry.SITE['weather_city_id']}' target='_blank' style='text-decoration: none;'>Weather Forecast {registry.SITE['weather_city']}</a></h4>",
                 unsafe_allow_html=True
             )
 
-        # Check for temperature alarms
-        alarms = check_temperature_alarms(df)
-        if alarms:
+        # alarms that are raised right now, and the latest alarm events
+        with profiler.stage('alarms'):
+            events = get_alarm_events(df)
+            active = alarms.active_alarms(events)
+        if not active.empty:
             st.error("Alarms Detected:")
-            for alarm in alarms:
-                st.write(alarm)
+            for alarm in active.itertuples():
+                st.write(f"{alarm.message} since {alarm.timestamp.strftime('%d/%m/%Y %H:%M')}")
+        if not events.empty:
+            with st.expander("Alarm Log"):
+                log = events.iloc[::-1].head(ALARM_LOG_ROWS)
+                st.dataframe(log[['timestamp', 'event', 'message']], hide_index=True, use_container_width=True)
 
         # plot historical temperature data
         col1, col2 = st.columns([3, 1])
         with col1:
-            time_range = st.selectbox("Select Time Range", ['Past Week', 'Past 3 Days', 'Past Day'],
+            time_range = st.selectbox("Select Time Range", TIME_RANGES,
                                       index=1, help="All visualizations are created based on this time frame")
         with col2:
             st.write("")  # adds a blank line
             st.write("")
             overkill_mode = st.checkbox("Advanced Mode", value=True)
-        unfiltered_df = df.copy()
-        filtered_df = filter_data(df, time_range)
-        plot_temperatures(filtered_df, time_range, overkill_mode, unfiltered_df)
+            live_mode = st.toggle("Live", help=f"Refresh the charts every {LIVE_REFRESH_SECONDS} seconds, "
+                                               "without reloading the rest of the page")
+        custom_dates = None
+        if time_range == 'Custom Range':
+            today = datetime.now(ATHENS_TZ).date()
+            custom_dates = st.date_input("Select Dates", value=(today - timedelta(days=7), today),
+                                         max_value=today)
+        start, end = get_time_bounds(time_range, custom_dates)
+        with profiler.stage('filter_data'):
+            filtered_df = filter_data(load_view(df, start, end, get_point_budget(time_range)), start, end)
+        if live_mode:
+            live_temperatures(time_range, custom_dates, overkill_mode)
+        else:
+            with profiler.stage('plot_temperatures'):
+                plot_temperatures(filtered_df, start, end, time_range, overkill_mode, df,
+                                  get_forecasts(overkill_mode, end))
         if overkill_mode:
-            plot_correlations(filtered_df)
-            plot_correlation_gauges(df)
-            metrics_df = calculate_metrics_per_boiler(df)
-            st.subheader("Metrics", help="Metrics to inspect sensors and boiler performance.")
-            st.dataframe(metrics_df, hide_index=True, use_container_width=True)
+            with profiler.stage('plot_correlations'):
+                plot_correlations(df, start, end)
+            with profiler.stage('plot_correlation_gauges'):
+                plot_correlation_gauges(df)
+            with profiler.stage('metrics table'):
+                metrics_df = calculate_metrics_per_boiler(get_window_stats(filtered_df), latest_data)
+                st.subheader("Metrics", help="Metrics to inspect sensors and boiler performance over the selected time range.")
+                st.dataframe(metrics_df, hide_index=True, use_container_width=True)
+        profiler.finish_run(time_range=time_range, advanced_mode=overkill_mode, rows=len(filtered_df))
 
 
 
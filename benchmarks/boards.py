@@ -0,0 +1,154 @@
+# benchmark of a board poll against a mock board served from a separate process: compares a new connection
+# per poll parsed with ElementTree (requests.get), the pooled session parsed with ElementTree (the collector
+# before http_client), and the pooled session with the streaming tag extractor of http_client
+#
+# usage: python benchmarks/boards.py [--polls 500] [--extra-tags 60] [--output report.json]
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# constants
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+BOARD_TAGS = {'Temperature1': 'temp_1', 'Temperature2': 'temp_2'}
+BOARD_TIMEOUT = 10
+SERVER_START_TIMEOUT = 10
+
+
+# a status.xml like the boards send: the state of their i/o first, then the thermometers, then more state
+def status_xml(extra_tags):
+    inputs = ''.join(f"<led{index}>{index % 2}</led{index}><btn{index}>up</btn{index}>" for index in range(8))
+    extra = ''.join(f"<io{index}>{index * 7 % 1024}</io{index}>" for index in range(extra_tags))
+    return (f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><response>{inputs}<pot0>512</pot0>"
+            f"<Temperature1>51.2°C</Temperature1><Temperature2>49.0°C</Temperature2>{extra}"
+            f"<uptime>123456</uptime></response>").encode()
+
+
+# serve the mock board until killed, with keep-alive connections like the boards
+def serve(port, extra_tags):
+    body = status_xml(extra_tags)
+
+    class BoardHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body are written separately, which nagle would hold back on a kept-alive connection
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), BoardHandler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"mock board did not start on port {port}")
+
+
+def parse_element_tree(content):
+    root = ET.fromstring(content)
+    return {column: float(root.find(tag).text.replace('°C', '')) for tag, column in BOARD_TAGS.items()}
+
+
+def parse_texts(texts):
+    return {column: float(texts[tag].replace('°C', '')) for tag, column in BOARD_TAGS.items()}
+
+
+# poll the board polls times with poll(), returning the latency percentiles and the client cpu per poll
+def measure(poll, polls):
+    poll()
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(polls):
+        start = time.perf_counter()
+        poll()
+        latencies.append((time.perf_counter() - start) * 1000)
+    cpu_ms = (time.process_time() - cpu_start) * 1000 / polls
+    latencies.sort()
+    return {'latency_ms': round(statistics.median(latencies), 3),
+            'p95_latency_ms': round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+            'cpu_ms': round(cpu_ms, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a board poll against a mock board.")
+    parser.add_argument('--polls', type=int, default=500, help="timed polls per variant")
+    parser.add_argument('--extra-tags', type=int, default=60, help="i/o tags after the thermometers in status.xml")
+    parser.add_argument('--output', help="path of an optional json report")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.extra_tags)
+        return
+
+    sys.path.insert(0, REPO_DIR)
+    import requests
+    import http_client
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port),
+                               '--extra-tags', str(args.extra_tags)])
+    try:
+        wait_for_server(port)
+        url = f"http://127.0.0.1:{port}/status.xml"
+        session = http_client.new_session(hosts=1, per_host=2)
+        plain_session = requests.Session()
+        variants = {
+            'new connection, ElementTree': lambda: parse_element_tree(
+                requests.get(url, timeout=BOARD_TIMEOUT).content),
+            'pooled, ElementTree': lambda: parse_element_tree(
+                plain_session.get(url, timeout=BOARD_TIMEOUT).content),
+            'pooled, streaming extractor': lambda: parse_texts(
+                http_client.fetch_tags(session, url, BOARD_TAGS, BOARD_TIMEOUT)),
+        }
+        results = {name: measure(poll, args.polls) for name, poll in variants.items()}
+    finally:
+        server.kill()
+        server.wait()
+
+    print(f"\nstatus.xml of {len(status_xml(args.extra_tags))} bytes, {args.polls} polls per variant")
+    for name, result in results.items():
+        print(f"  {name:30} {result['latency_ms']:8.3f} ms median  {result['p95_latency_ms']:8.3f} ms p95  "
+              f"{result['cpu_ms']:8.3f} ms cpu")
+
+    if args.output:
+        report = {'created_at': datetime.now().astimezone().isoformat(), 'python': platform.python_version(),
+                  'machine': platform.machine(), 'polls': args.polls,
+                  'status_bytes': len(status_xml(args.extra_tags)), 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# benchmark of the dashboard on synthetic histories of growing size: times the data path of app.py and
+# the collector's save path headlessly, and writes a json report with latency, peak memory and the
+# bytes of every figure sent to the browser
+#
+# usage: python benchmarks/dashboard.py [--days 7,30,365,1095] [--repeat 5] [--output report.json]
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# constants
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_DAYS = [7, 30, 365, 3 * 365]
+BENCHMARK_RANGES = ['Past Day', 'Past Week', 'Past Month', 'This Heating Season']
+# samples appended through the collector's save path per size
+SAVE_SAMPLES = 50
+# the synthetic history is written as a single-file csv and migrated like a legacy one
+SYNTHETIC_CSV = 'temperature_data.csv'
+
+
+# time fn over repeat calls and trace the peak memory of one more call
+# figures passed to st.plotly_chart during the traced call are measured in bytes of their json
+def measure(fn, repeat, figures):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    figures.clear()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {'latency_ms': round(statistics.median(latencies), 3), 'min_latency_ms': round(min(latencies), 3),
+              'peak_memory_bytes': peak}
+    if figures:
+        result['figure_bytes'] = list(figures)
+    return result
+
+
+# benchmark one history size in the current directory, which holds nothing but the synthetic data
+def run_size(days, repeat):
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCHMARK_DIR)
+    import plotly.io as pio
+    import streamlit as st
+    import synthetic
+    import schema
+    import storage
+    import rollups
+    import correlations
+    import app
+    import fetch_data
+
+    # what streamlit sends to the browser for a figure is its plotly json
+    figures = []
+    plotly_chart = st.plotly_chart
+
+    def record_chart(fig, *args, **kwargs):
+        figures.append(len(pio.to_json(fig, validate=False)))
+        return plotly_chart(fig, *args, **kwargs)
+    st.plotly_chart = record_chart
+
+    report = {'days': days}
+    start = time.perf_counter()
+    report['samples'] = synthetic.write_csv(days, SYNTHETIC_CSV)
+    report['csv_bytes'] = os.path.getsize(SYNTHETIC_CSV)
+    report['generate_s'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    storage.migrate_csv(SYNTHETIC_CSV)
+    report['migrate_s'] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    rollups.rebuild_rollups()
+    correlations.rebuild_correlations()
+    report['rebuild_s'] = round(time.perf_counter() - start, 3)
+
+    results = {}
+    # a cold load parses every segment, later ones are answered from the process-wide cache
+    def load_cold():
+        storage._cache.update(files={}, frame=None)
+        return app.load_data()
+    results['load_data (cold)'] = measure(load_cold, repeat, figures)
+    results['load_data'] = measure(app.load_data, repeat, figures)
+    df = app.load_data()
+    latest = df.iloc[-1]
+    # memory of the loaded frame, shared by every session of the app
+    report['frame_bytes_per_row'] = round(df.memory_usage(deep=True).sum() / len(df), 1)
+
+    for time_range in BENCHMARK_RANGES:
+        start, end = app.get_time_bounds(time_range)
+        max_points = app.get_point_budget(time_range)
+        view = app.filter_data(app.load_view(df, start, end, max_points), start, end)
+        results[f"filter_data [{time_range}]"] = measure(
+            lambda: app.filter_data(app.load_view(df, start, end, max_points), start, end), repeat, figures)
+        # the figures are built once per view, a rerun for another widget takes them from the cache
+        def plot_uncached():
+            app.build_temperature_figures.clear()
+            app.plot_temperatures(view, start, end, time_range, True, df)
+        results[f"plot_temperatures (build) [{time_range}]"] = measure(plot_uncached, repeat, figures)
+        results[f"plot_temperatures [{time_range}]"] = measure(
+            lambda: app.plot_temperatures(view, start, end, time_range, True, df), repeat, figures)
+        results[f"add_sun_overlay [{time_range}]"] = measure(
+            lambda: app.add_sun_overlay(app.go.Figure(), app.get_sun_shapes(
+                df, view['timestamp'].iloc[0], view['timestamp'].iloc[-1])), repeat, figures)
+        results[f"calculate_metrics_per_boiler [{time_range}]"] = measure(
+            lambda: app.calculate_metrics_per_boiler(app.get_window_stats(view), latest), repeat, figures)
+        results[f"plot_correlations [{time_range}]"] = measure(
+            lambda: app.plot_correlations(df, start, end), repeat, figures)
+    results['plot_correlation_gauges'] = measure(lambda: app.plot_correlation_gauges(df), repeat, figures)
+
+    # the collector's write path, which replaced save_to_csv: the synced log append, with the rollups and
+    # co-moments flushed in batches by the journal
+    sun = app.load_sun()
+    sample = {col: latest[col] for col in storage.COLUMNS if col in schema.SAMPLE_DTYPES}
+    sample.update({col: sun[name].iloc[-1].isoformat() for col, name in schema.SUN_COLUMNS.items()})
+    next_at = [latest['timestamp']]
+
+    def save_sample():
+        next_at[0] += timedelta(minutes=5)
+        fetch_data.save_sample(dict(sample), next_at[0])
+    results['save_sample'] = measure(save_sample, SAVE_SAMPLES, figures)
+
+    report['results'] = results
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard on synthetic histories.")
+    parser.add_argument('--days', default=','.join(map(str, DEFAULT_DAYS)),
+                        help="comma separated history sizes in days")
+    parser.add_argument('--repeat', type=int, default=5, help="timed calls per function")
+    parser.add_argument('--output', default='benchmark_report.json', help="path of the json report")
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        print(json.dumps(run_size(args.run_size, args.repeat)))
+        return
+
+    report = {'created_at': datetime.now().astimezone().isoformat(), 'python': platform.python_version(),
+              'machine': platform.machine(), 'repeat': args.repeat, 'sizes': []}
+    for days in [int(days) for days in args.days.split(',')]:
+        # every size runs in a fresh interpreter and data directory, so no cache carries over
+        with tempfile.TemporaryDirectory() as workdir:
+            # and a feed of its own, the collector's feed of the site stays untouched
+            env = {**os.environ, 'DATA_DIR': os.path.join(workdir, 'data'),
+                   'FEED_NAME': f"benchmark_{os.getpid()}_{days}_feed"}
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-size', str(days),
+                                     '--repeat', str(args.repeat)],
+                                    cwd=workdir, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Error benchmarking {days} days:\n{result.stderr}")
+            sys.exit(1)
+        size = json.loads(result.stdout.splitlines()[-1])
+        report['sizes'].append(size)
+
+        print(f"\n{days} days, {size['samples']} samples ({size['csv_bytes'] / 1e6:.1f} MB csv), "
+              f"migrate {size['migrate_s']} s, rebuild {size['rebuild_s']} s, "
+              f"{size['frame_bytes_per_row']} bytes per loaded row")
+        for name, result in size['results'].items():
+            figure_bytes = f"  {sum(result['figure_bytes']) / 1000:9.1f} kB sent" if 'figure_bytes' in result else ''
+            print(f"  {name:52} {result['latency_ms']:10.2f} ms  {result['peak_memory_bytes'] / 1e6:8.1f} MB peak"
+                  f"{figure_bytes}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# startup benchmark of the dashboard: imports app.py in fresh interpreters with -X importtime and
+# reports the import time per module, so regressions of the cold start get caught
+#
+# usage: python benchmarks/startup.py [--runs 5] [--budget-ms 1500] [--top 15]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# constants
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules that must only be imported when the feature using them is rendered
+LAZY_MODULES = ['statsmodels', 'plotly.subplots']
+
+
+# import app in a fresh interpreter, returns [(module, self us, cumulative us, depth)] in import order
+def measure_imports():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing app failed:\n{result.stderr}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of app.py per module.")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters to import app in")
+    parser.add_argument('--budget-ms', type=float, default=None, help="fail if the median import of app takes longer")
+    parser.add_argument('--top', type=int, default=15, help="number of modules with the highest self time to list")
+    args = parser.parse_args()
+
+    runs = [measure_imports() for _ in range(args.runs)]
+
+    # median over the runs of the cumulative time of the modules app imports directly, and of the self time of all
+    direct, own, totals = {}, {}, []
+    for imports in runs:
+        for name, self_us, _, _ in imports:
+            own.setdefault(name, []).append(self_us)
+        # -X importtime lists the imports of a module right before the module itself
+        position = next(i for i, (name, _, _, _) in enumerate(imports) if name == 'app')
+        app_depth = imports[position][3]
+        totals.append(imports[position][2])
+        for name, _, cumulative_us, depth in reversed(imports[:position]):
+            if depth <= app_depth:
+                break
+            if depth == app_depth + 1:
+                direct.setdefault(name, []).append(cumulative_us)
+    total = statistics.median(totals)
+
+    print(f"import app: {total / 1000:.1f} ms (median of {args.runs} runs)")
+    print("\nimported by app (cumulative):")
+    for name, times in sorted(direct.items(), key=lambda item: -statistics.median(item[1])):
+        print(f"  {statistics.median(times) / 1000:8.1f} ms  {name}")
+    print("\nslowest modules (self):")
+    for name, times in sorted(own.items(), key=lambda item: -statistics.median(item[1]))[:args.top]:
+        print(f"  {statistics.median(times) / 1000:8.1f} ms  {name}")
+
+    failures = []
+    imported = {name for name, _, _, _ in runs[0]}
+    for module in LAZY_MODULES:
+        if any(name == module or name.startswith(f"{module}.") for name in imported):
+            failures.append(f"{module} is imported on the startup path")
+    if args.budget_ms is not None and total / 1000 > args.budget_ms:
+        failures.append(f"import took {total / 1000:.1f} ms, over the budget of {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"\nFAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
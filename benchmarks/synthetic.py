@@ -0,0 +1,87 @@
+# generator of synthetic history in the schema of temperature_data.csv: 5-minute samples of the boiler
+# sensors of the site (see sites.json) with daily and seasonal cycles, board outages and the weather
+# columns of fetch_data
+#
+# usage: python benchmarks/synthetic.py DAYS [OUTPUT_CSV]
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import registry
+import storage
+
+# constants
+SAMPLE_INTERVAL = '5min'
+# sensors of every board of the site, a board that does not answer leaves all of them empty
+BOARD_SENSORS = [[sensor['column'] for sensor in board['sensors']] for board in registry.BOARDS]
+# chance of a board outage starting at a sample, and its mean length in samples
+OUTAGE_RATE = 0.0005
+OUTAGE_SAMPLES = 24
+SEED = 42
+
+
+# day length cycle of Agios Nikolaos, hours of sunrise and sunset per day of year
+def sun_hours(day_of_year):
+    half_day = 6 + 1.1 * np.sin(2 * np.pi * (day_of_year - 80) / 365)
+    # solar noon at 25.7 E is about 12:17 standard time, an hour later in summer time
+    noon = 12.3 + np.where((day_of_year > 87) & (day_of_year < 300), 1, 0)
+    return noon - half_day, noon + half_day
+
+
+# build days of samples ending at end (default now) as the raw csv rows written by fetch_data
+def generate(days, end=None, seed=SEED):
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now(tz=storage.ATHENS_TZ) if end is None else end
+    timestamps = pd.date_range(end=end.floor(SAMPLE_INTERVAL), periods=days * 288, freq=SAMPLE_INTERVAL)
+    n = len(timestamps)
+    hour = (timestamps.hour + timestamps.minute / 60).to_numpy()
+    day_of_year = timestamps.dayofyear.to_numpy()
+
+    # the boilers run hotter in the heating season, and follow a daily heating cycle
+    heating = (day_of_year >= 288) | (day_of_year < 121)
+    exterior = (18 + 8 * np.sin(2 * np.pi * (day_of_year - 110) / 365) + 4 * np.sin(2 * np.pi * (hour - 9) / 24)
+                + rng.normal(0, 0.8, n))
+    rows = {'timestamp': [ts.isoformat() for ts in timestamps]}
+    for index, col in enumerate(storage.SENSOR_COLUMNS):
+        base = np.where(heating, 58, 34) + index
+        cycle = np.where(heating, 9, 4) * np.sin(2 * np.pi * (hour - 6 - index / 3) / 24)
+        # slow wandering of about a degree around the cycle
+        noise = rng.normal(0, 12, n)
+        noise[0] = 0
+        drift = pd.Series(noise).ewm(span=288, adjust=False).mean().to_numpy()
+        rows[col] = np.round(base + cycle + 0.2 * (exterior - 18) + drift + rng.normal(0, 0.4, n), 2)
+
+    cloudiness = np.clip(np.cumsum(rng.normal(0, 3, n)) % 200 - 50, 0, 100)
+    rows['current_cloudiness'] = np.round(cloudiness).astype(int)
+    rows['current_temp'] = np.round(exterior, 2)
+    rows['current_humidity'] = np.clip(np.round(65 - 1.5 * (exterior - 18) + rng.normal(0, 5, n)), 10, 100).astype(int)
+    # the weather API reports the sunrise and sunset of the day of the request
+    days_start, day_index = np.unique(timestamps.normalize(), return_inverse=True)
+    days_start = pd.DatetimeIndex(days_start).tz_convert(storage.ATHENS_TZ)
+    sunrise, sunset = sun_hours(days_start.dayofyear.to_numpy())
+    for col, hours in [('current_sunrise', sunrise), ('current_sunset', sunset)]:
+        times = np.array([ts.isoformat() for ts in days_start + pd.to_timedelta(hours, unit='h').round('s')])
+        rows[col] = times[day_index]
+    rows['three_day_forecast_avg'] = np.round(pd.Series(cloudiness).rolling(864, min_periods=1).mean(), 1)
+    df = pd.DataFrame(rows)
+
+    # boards that did not answer leave their sensors empty for a while
+    for sensors in BOARD_SENSORS:
+        for start in np.nonzero(rng.random(n) < OUTAGE_RATE)[0]:
+            length = int(rng.exponential(OUTAGE_SAMPLES)) + 1
+            df.loc[start:start + length - 1, sensors] = np.nan
+    return df.reindex(columns=storage.COLUMNS)
+
+
+def write_csv(days, path, end=None):
+    df = generate(days, end)
+    df.to_csv(path, index=False)
+    return len(df)
+
+
+if __name__ == "__main__":
+    output = sys.argv[2] if len(sys.argv) > 2 else storage.LEGACY_CSV_FILE or 'temperature_data.csv'
+    print(f"Wrote {write_csv(int(sys.argv[1]), output)} samples to {output}")
@@ -0,0 +1,255 @@
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta, time as dt_time
+import numpy as np
+import pandas as pd
+import storage
+
+# constants
+CORRELATION_DIR = os.path.join(storage.DATA_DIR, 'correlations')
+HOURLY_FILE = os.path.join(CORRELATION_DIR, 'hourly.bin')
+DAILY_FILE = os.path.join(CORRELATION_DIR, 'daily.bin')
+WEATHER_COLUMNS = ['current_cloudiness', 'current_temp', 'current_humidity']
+LAGGED_COLUMNS = ['current_cloudiness', 'current_temp']
+LAG_HOURS = [1, 2, 3]
+# a lagged value is only used if a sample exists this close to the lagged time
+LAG_TOLERANCE = timedelta(minutes=10)
+# the hourly blocks form a ring covering the last 8 days, older windows are answered from daily blocks
+HOURLY_BLOCKS = 8 * 24
+
+
+# name of the column holding the value of a weather column some hours before the sample
+def lagged_column(col, hours):
+    return f"{col}_lag{hours}h"
+
+
+VARIABLES = [*storage.SENSOR_COLUMNS, *WEATHER_COLUMNS,
+             *[lagged_column(col, hours) for hours in LAG_HOURS for col in LAGGED_COLUMNS]]
+# values are centered on rough typical levels before summing, which keeps the sums well conditioned
+CENTER = np.array([50.0 if col in storage.SENSOR_COLUMNS else 20.0 if col.startswith('current_temp') else 50.0
+                   for col in VARIABLES])
+
+# every block holds pairwise sums over the samples in which both variables i and j are present:
+#   sums[0][i, j]  number of samples      sums[1][i, j]  sum of x_i
+#   sums[2][i, j]  sum of x_i ** 2        sums[3][i, j]  sum of x_i * x_j
+# sums of blocks can simply be added up, which makes any window a sum over its blocks
+BLOCK = np.dtype([('start', '<i8'), ('sums', '<f8', (4, len(VARIABLES), len(VARIABLES)))])
+
+# recent weather of the collector for the lagged variables, (epoch seconds, {column: value})
+_history = deque()
+_history_seeded = False
+# blocks loaded by the app, path -> (stat, blocks)
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+# pairwise sums of a matrix of samples (rows) by variables (columns), NaN meaning missing
+def block_sums(values):
+    present = ~np.isnan(values)
+    centered = np.where(present, values - CENTER, 0.0)
+    present = present.astype(float)
+    return np.stack([present.T @ present, centered.T @ present, (centered ** 2).T @ present,
+                     centered.T @ centered])
+
+
+# pearson correlation of every pair of variables from their summed blocks
+def correlation_matrix(sums):
+    n, sx, sxx, sxy = sums
+    sy, syy = sx.T, sxx.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    corr[n < 3] = np.nan
+    return pd.DataFrame(np.clip(corr, -1, 1), index=VARIABLES, columns=VARIABLES)
+
+
+# add the lagged weather columns to a frame of samples, matching each sample with the closest
+# earlier sample taken the lag before it
+def add_lagged_columns(df):
+    # as float64, the loaded samples come in the compact dtypes of schema.py
+    df = df[['timestamp', *storage.SENSOR_COLUMNS, *WEATHER_COLUMNS]].astype(
+        dict.fromkeys([*storage.SENSOR_COLUMNS, *WEATHER_COLUMNS], float))
+    for hours in LAG_HOURS:
+        earlier = df[['timestamp', *LAGGED_COLUMNS]].dropna(subset=['timestamp'])
+        earlier = earlier.assign(timestamp=earlier['timestamp'] + timedelta(hours=hours))
+        earlier = earlier.rename(columns={col: lagged_column(col, hours) for col in LAGGED_COLUMNS})
+        lagged = pd.merge_asof(df[['timestamp']], earlier, on='timestamp', direction='backward',
+                               tolerance=pd.Timedelta(LAG_TOLERANCE))
+        for col in LAGGED_COLUMNS:
+            df[lagged_column(col, hours)] = lagged[lagged_column(col, hours)].to_numpy()
+    return df
+
+
+# summed blocks of a frame of raw samples, used when the collector has not written any blocks
+def sums_from_samples(df):
+    return block_sums(add_lagged_columns(df)[VARIABLES].to_numpy(dtype=float))
+
+
+def _hour_start(ts):
+    return int(ts.timestamp()) // 3600 * 3600
+
+
+def _day_start(ts):
+    return int(storage.ATHENS_TZ.localize(datetime.combine(ts.date(), dt_time())).timestamp())
+
+
+# add sums to the block at index of a block file, resetting the block if it belongs to an older period
+def _add_to_block(path, index, start, sums):
+    with open(path, 'r+b') as f:
+        f.seek(index * BLOCK.itemsize)
+        raw = f.read(BLOCK.itemsize)
+        block = np.frombuffer(raw, BLOCK).copy() if len(raw) == BLOCK.itemsize else np.zeros(1, BLOCK)
+        if block['start'][0] != start:
+            block['start'], block['sums'] = start, 0.0
+        block['sums'][0] += sums
+        f.seek(index * BLOCK.itemsize)
+        f.write(block.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _create_block_files():
+    os.makedirs(CORRELATION_DIR, exist_ok=True)
+    # the ring is preallocated, a block with start 0 is unused
+    np.zeros(HOURLY_BLOCKS, BLOCK).tofile(HOURLY_FILE)
+    open(DAILY_FILE, 'wb').close()
+
+
+# whether the block files exist and were written for the current variables
+def _layout_matches():
+    try:
+        return (os.path.getsize(HOURLY_FILE) == HOURLY_BLOCKS * BLOCK.itemsize
+                and os.path.getsize(DAILY_FILE) % BLOCK.itemsize == 0)
+    except FileNotFoundError:
+        return False
+
+
+def _daily_index(day_start):
+    count = os.path.getsize(DAILY_FILE) // BLOCK.itemsize
+    if count:
+        with open(DAILY_FILE, 'rb') as f:
+            f.seek((count - 1) * BLOCK.itemsize)
+            if np.frombuffer(f.read(8), '<i8')[0] == day_start:
+                return count - 1
+    return count
+
+
+# remember the weather of the last hours, seeded from the store after a restart
+def _remember_weather(epoch, sample):
+    global _history_seeded
+    if not _history_seeded:
+        _history_seeded = True
+        df = storage.load_samples()
+        if not df.empty:
+            recent = df[df['timestamp'] >= df['timestamp'].iloc[-1] - timedelta(hours=max(LAG_HOURS) + 1)]
+            for ts, *values in recent[['timestamp', *LAGGED_COLUMNS]].itertuples(index=False):
+                if ts.timestamp() < epoch:
+                    _history.append((ts.timestamp(), dict(zip(LAGGED_COLUMNS, values))))
+    _history.append((epoch, {col: sample.get(col) for col in LAGGED_COLUMNS}))
+    while _history and _history[0][0] < epoch - (max(LAG_HOURS) * 3600 + LAG_TOLERANCE.total_seconds()):
+        _history.popleft()
+
+
+# weather of the closest sample taken at or before epoch, within the lag tolerance
+def _weather_at(epoch):
+    for at, weather in reversed(_history):
+        if at <= epoch:
+            return weather if at >= epoch - LAG_TOLERANCE.total_seconds() else {}
+    return {}
+
+
+def _sample_values(sample, epoch):
+    values = {col: sample.get(col) for col in [*storage.SENSOR_COLUMNS, *WEATHER_COLUMNS]}
+    for hours in LAG_HOURS:
+        weather = _weather_at(epoch - hours * 3600)
+        for col in LAGGED_COLUMNS:
+            values[lagged_column(col, hours)] = weather.get(col)
+    return np.array([[np.nan if values[col] in (None, '') else float(values[col]) for col in VARIABLES]])
+
+
+# fold new samples into the hourly and daily co-moment blocks - called by the collector once the
+# samples are stored, costs one small read and write per block they fall in
+def update_correlations(samples):
+    if not _layout_matches():
+        # first run, or the sensors of the site changed - the rebuild already covers these samples,
+        # which were stored before calling us
+        rebuild_correlations()
+        return
+
+    hourly, daily = {}, {}
+    for sample in samples:
+        ts = datetime.fromisoformat(sample['timestamp']).astimezone(storage.ATHENS_TZ)
+        epoch = ts.timestamp()
+        _remember_weather(epoch, sample)
+        sums = block_sums(_sample_values(sample, epoch))
+        hour_start, day_start = _hour_start(ts), _day_start(ts)
+        hourly[hour_start] = hourly.get(hour_start, 0) + sums
+        daily[day_start] = daily.get(day_start, 0) + sums
+
+    for hour_start, sums in hourly.items():
+        _add_to_block(HOURLY_FILE, hour_start // 3600 % HOURLY_BLOCKS, hour_start, sums)
+    for day_start, sums in daily.items():
+        _add_to_block(DAILY_FILE, _daily_index(day_start), day_start, sums)
+
+
+# recompute all blocks from the stored samples, e.g. after migrating existing history
+def rebuild_correlations():
+    _create_block_files()
+    df = storage.load_samples()
+    if df.empty:
+        return
+    df = add_lagged_columns(df)
+    values = df[VARIABLES].to_numpy(dtype=float)
+    epochs = df['timestamp'].to_numpy('datetime64[s]').astype('int64')
+    hours = epochs // 3600 * 3600
+    days = df['timestamp'].dt.normalize().to_numpy('datetime64[s]').astype('int64')
+
+    hourly = np.zeros(HOURLY_BLOCKS, BLOCK)
+    for hour_start in np.unique(hours)[-HOURLY_BLOCKS:]:
+        index = hour_start // 3600 % HOURLY_BLOCKS
+        hourly[index] = (hour_start, block_sums(values[hours == hour_start]))
+    hourly.tofile(HOURLY_FILE)
+
+    unique_days = np.unique(days)
+    daily = np.zeros(len(unique_days), BLOCK)
+    for index, day_start in enumerate(unique_days):
+        daily[index] = (day_start, block_sums(values[days == day_start]))
+    daily.tofile(DAILY_FILE)
+
+
+def _load_blocks(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    stat = (st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is None or entry[0] != stat:
+            entry = (stat, np.fromfile(path, BLOCK))
+            _cache[path] = entry
+    return entry[1]
+
+
+# summed blocks of the samples from start until end (exclusive, like the midnight ending a custom range),
+# or None when the collector has not written any
+# windows within the hourly ring are accurate to the hour, older ones to the day
+def load_sums(start, end):
+    if not _layout_matches():
+        return None
+    hourly, daily = _load_blocks(HOURLY_FILE), _load_blocks(DAILY_FILE)
+    if hourly is None or daily is None:
+        return None
+
+    used = hourly[hourly['start'] > 0]
+    # slots of hours the collector missed may still hold blocks from an earlier lap of the ring
+    ring_start = used['start'].max() - (HOURLY_BLOCKS - 1) * 3600 if len(used) else None
+    if ring_start is not None and _hour_start(start) >= ring_start:
+        blocks = used[(used['start'] >= _hour_start(start)) & (used['start'] < end.timestamp())]
+    else:
+        blocks = daily[(daily['start'] >= _day_start(start)) & (daily['start'] < end.timestamp())]
+    return blocks['sums'].sum(axis=0) if len(blocks) else np.zeros(BLOCK['sums'].shape)
+
+
+if __name__ == "__main__":
+    rebuild_correlations()
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+
+# pick the positions of a min/max envelope of the series: for every bucket keep the lowest and
+# the highest reading, plus the first missing reading so gaps in the data stay visible
+def minmax_indices(values, max_points):
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+
+    values = pd.Series(np.asarray(values, dtype=float))
+    buckets = pd.Series(np.arange(n) * (max_points // 2) // n)
+    present = values.notna()
+
+    grouped = values[present].groupby(buckets[present])
+    keep = [grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy(), [0, n - 1]]
+    if not present.all():
+        keep.append(buckets[~present].drop_duplicates().index.to_numpy())
+    return np.unique(np.concatenate(keep))
+
+
+# the min/max envelope of a column of a rollup: for every group of buckets the lowest minimum and the highest
+# maximum, each at the time of its bucket, plus the first bucket without readings of the group for the gaps
+def envelope_indices(low, high, max_points):
+    n = len(low)
+    low, high = pd.Series(np.asarray(low, dtype=float)), pd.Series(np.asarray(high, dtype=float))
+    buckets = pd.Series(np.arange(n) * min(n, max(max_points // 2, 1)) // n)
+    present = low.notna()
+
+    lows = low[present].groupby(buckets[present]).idxmin().to_numpy()
+    highs = high[present].groupby(buckets[present]).idxmax().to_numpy()
+    gaps = buckets[~present].drop_duplicates().index.to_numpy()
+    indices = np.concatenate([lows, highs, gaps])
+    values = np.concatenate([low[lows], high[highs], np.full(len(gaps), np.nan)])
+    # in time order, the minimum of a bucket before its maximum
+    order = np.argsort(indices, kind='stable')
+    return indices[order], values[order]
+
+
+# downsample a column of a time-indexed frame to at most about max_points points - a rollup, which has the
+# minimum and maximum of its buckets next to their mean, is drawn as the envelope of those, so its peaks and
+# dips are not averaged away
+def downsample_series(df, column, max_points):
+    if f"{column}_min" in df.columns:
+        indices, values = envelope_indices(df[f"{column}_min"].to_numpy(), df[f"{column}_max"].to_numpy(),
+                                           max_points)
+        x = df['timestamp'].iloc[indices]
+        return x, pd.Series(values, index=x.index, name=column)
+    indices = minmax_indices(df[column].to_numpy(), max_points)
+    return df['timestamp'].iloc[indices], df[column].iloc[indices]
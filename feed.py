@@ -0,0 +1,199 @@
+import atexit
+import os
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import pandas as pd
+import registry
+import schema
+import storage
+
+# constants
+# one feed per site, so the collectors of several sites can run side by side
+FEED_NAME = os.getenv('FEED_NAME', f"{registry.SITE_ID}_feed")
+# the ring holds the samples of the last day, a reader that falls further behind reloads from the store
+FEED_SLOTS = 288
+# values of a sample in a slot - timestamps, sunrise and sunset as unix time in nanoseconds, which gives back
+# the stored timestamps exactly, everything else as float
+FEED_COLUMNS = storage.COLUMNS
+TIME_COLUMNS = ['timestamp', 'current_sunrise', 'current_sunset']
+VALUE_COLUMNS = [col for col in FEED_COLUMNS if col not in TIME_COLUMNS]
+# a missing time, the integer of NaT
+NO_TIME = np.iinfo(np.int64).min
+# a feed without news for this long may belong to a collector that has been restarted, so the app
+# checks the store and attaches again
+FEED_STALE_SECONDS = 600
+FEED_READ_ATTEMPTS = 1000
+
+# the segment starts with a header, followed by the ring of slots
+# version is a seqlock: odd while the collector writes a slot, count is the number of samples published so far,
+# pid the process of the collector that writes the feed
+HEADER = np.dtype([('generation', '<u8'), ('version', '<u8'), ('count', '<u8'), ('pid', '<u8')])
+SLOT = np.dtype([('seq', '<u8'), ('times', '<i8', (len(TIME_COLUMNS),)), ('values', '<f8', (len(VALUE_COLUMNS),))])
+FEED_SIZE = HEADER.itemsize + FEED_SLOTS * SLOT.itemsize
+
+# segment of the collector
+_writer = None
+# segment and samples of the app, shared by all sessions
+_reader_lock = threading.Lock()
+_reader = {'segment': None, 'generation': None, 'seen': 0, 'frame': None, 'sun': None, 'checked_at': 0.0}
+
+
+def _views(segment):
+    header = np.ndarray((), HEADER, buffer=segment.buf)
+    slots = np.ndarray((FEED_SLOTS,), SLOT, buffer=segment.buf, offset=HEADER.itemsize)
+    return header, slots
+
+
+def _to_time(value):
+    return NO_TIME if storage.is_missing(value) else pd.Timestamp(str(value)).value
+
+
+def _to_number(value):
+    return np.nan if storage.is_missing(value) else float(value)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# create the feed of the collector, replacing the one of a collector that did not shut down cleanly
+# raises RuntimeError when the feed belongs to a collector that is still running
+def open_writer():
+    global _writer
+    try:
+        segment = shared_memory.SharedMemory(FEED_NAME)
+    except FileNotFoundError:
+        pass
+    else:
+        pid = int(_views(segment)[0]['pid']) if segment.size >= HEADER.itemsize else 0
+        if pid and pid != os.getpid() and _is_running(pid):
+            # not ours to unlink, neither now nor when this process exits
+            resource_tracker.unregister(segment._name, 'shared_memory')
+            segment.close()
+            raise RuntimeError(f"Feed {FEED_NAME} is written by the running process {pid}, set FEED_NAME")
+        segment.close()
+        segment.unlink()
+    _writer = shared_memory.SharedMemory(FEED_NAME, create=True, size=FEED_SIZE)
+    header, _ = _views(_writer)
+    header['generation'] = int.from_bytes(os.urandom(8), 'little')
+    header['pid'] = os.getpid()
+    atexit.register(close_writer)
+    return _writer
+
+
+# remove the feed when the collector exits, the app then falls back to reading the store
+def close_writer():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer.unlink()
+        _writer = None
+
+
+# publish a stored sample to the app - called by the collector after the sample is written to disk
+def publish(sample):
+    if _writer is None:
+        open_writer()
+    header, slots = _views(_writer)
+    count = int(header['count'])
+    times = [_to_time(sample.get(col)) for col in TIME_COLUMNS]
+    values = [_to_number(sample.get(col)) for col in VALUE_COLUMNS]
+
+    header['version'] += 1
+    slots[count % FEED_SLOTS] = (count + 1, times, values)
+    header['count'] = count + 1
+    header['version'] += 1
+
+
+# attach to the collector's feed, or None when it is not running
+def _attach():
+    try:
+        segment = shared_memory.SharedMemory(FEED_NAME)
+    except (FileNotFoundError, ValueError):
+        return None
+    # python < 3.13 would unlink the segment when the app exits, although it belongs to the collector
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+# copy the slots of the samples published after seen, consistent with each other thanks to the seqlock
+# returns (generation, count, slots) or None when the reader fell behind the ring
+def _read_since(segment, seen):
+    header, slots = _views(segment)
+    # a collector that died while writing leaves the seqlock odd, give up and read the store instead
+    for _ in range(FEED_READ_ATTEMPTS):
+        version = int(header['version'])
+        if version % 2:
+            time.sleep(0)
+            continue
+        generation, count = int(header['generation']), int(header['count'])
+        if count - seen > FEED_SLOTS:
+            return None
+        indices = [seq % FEED_SLOTS for seq in range(seen, count)]
+        copied = slots[indices].copy()
+        if int(header['version']) == version and (copied['seq'] == np.arange(seen + 1, count + 1)).all():
+            return generation, count, copied
+    return None
+
+
+# the samples of slots like storage.load_samples has them, and their sun table
+def _samples_frame(slots):
+    df = pd.DataFrame(slots['values'], columns=VALUE_COLUMNS)
+    for index, col in enumerate(TIME_COLUMNS):
+        times = slots['times'][:, index].view('datetime64[ns]')
+        df[col] = pd.to_datetime(times, utc=True).tz_convert(storage.ATHENS_TZ)
+    return schema.compact(df[FEED_COLUMNS])
+
+
+# all samples, like storage.load_samples, kept up to date from the collector's feed: new samples are
+# appended from shared memory without touching the store, which is only read again when the feed is
+# missing, restarted or was outrun - the returned frame is shared and must not be modified
+def load_samples():
+    with _reader_lock:
+        reader = _reader
+        now = time.monotonic()
+        if reader['segment'] is None or now - reader['checked_at'] > FEED_STALE_SECONDS:
+            if reader['segment'] is not None:
+                reader['segment'].close()
+            reader['segment'], reader['frame'] = _attach(), None
+        if reader['segment'] is None:
+            reader['sun'] = None
+            return storage.load_samples()
+
+        result = _read_since(reader['segment'], reader['seen'])
+        if result is None or result[0] != reader['generation'] or reader['frame'] is None:
+            # the store holds every published sample, as the collector publishes after writing
+            header, _ = _views(reader['segment'])
+            reader['generation'], reader['seen'] = int(header['generation']), int(header['count'])
+            reader['frame'], reader['checked_at'] = storage.load_samples(), now
+            reader['sun'] = storage.load_sun()
+            return reader['frame']
+
+        generation, count, slots = result
+        if count > reader['seen']:
+            new_rows, new_sun = _samples_frame(slots)
+            reader['sun'] = schema.merge_sun([reader['sun'], new_sun])
+            frame = reader['frame']
+            if not frame.empty:
+                # samples published while the store was read are in both
+                new_rows = new_rows[new_rows['timestamp'] > frame['timestamp'].iloc[-1]]
+            if not new_rows.empty:
+                reader['frame'] = pd.concat([frame, new_rows], ignore_index=True) if not frame.empty else new_rows
+            reader['seen'], reader['checked_at'] = count, now
+        return reader['frame']
+
+
+# sunrise and sunset of every day of the samples last returned by load_samples, like storage.load_sun
+def load_sun():
+    with _reader_lock:
+        if _reader['sun'] is None:
+            return storage.load_sun()
+        return _reader['sun']
@@ -1,65 +1,75 @@
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-import pandas as pd
 import os
 import pytz
+import threading
 import time
 from dotenv import load_dotenv
+import registry
+import storage
+import forecasting
+import metrics
+import http_client
+import feed
+import scheduler
+import journal
+import alarms
 
 # load environment variables
 load_dotenv()
 WEATHER_API_KEY = os.getenv('WEATHER_API_KEY')
 
 # constants
-LATITUDE = 35.2146968
-LONGITUDE = 25.7094369
+LATITUDE = registry.SITE['latitude']
+LONGITUDE = registry.SITE['longitude']
 ATHENS_TZ = pytz.timezone('Europe/Athens')
-CSV_FILE = 'temperature_data.csv'
 WEATHER_CURRENT_URL = 'https://api.openweathermap.org/data/2.5/weather'
 WEATHER_FORECAST_URL = 'https://api.openweathermap.org/data/2.5/forecast'
+WEATHER_TIMEOUT = 10
+WEATHER_CACHE_FILE = os.path.join(storage.DATA_DIR, 'weather_cache.json')
+# seconds a weather response stays fresh, and how old it may get before we stop serving it when the API fails
+# the forecast is only updated every few hours, the current weather roughly every 10 minutes
+WEATHER_TTL = {WEATHER_CURRENT_URL: 10 * 60, WEATHER_FORECAST_URL: 3 * 3600}
+WEATHER_MAX_STALE = {WEATHER_CURRENT_URL: 3600, WEATHER_FORECAST_URL: 12 * 3600}
+# responses are refreshed on their own schedule every WEATHER_TTL seconds, up to this many seconds late
+WEATHER_JITTER = 30
+# seconds between two samples of the boards, see registry.py - the weather does not change that often,
+# so polling the boards more often only costs requests to our own boards
+SAMPLE_INTERVAL = registry.SAMPLE_INTERVAL
+# finished days are compacted hourly, a few minutes past the hour
+COMPACTION_INTERVAL = 3600
+COMPACTION_OFFSET = 120
+# seconds between two checks whether the samples buffered by the journal are due to be flushed
+FLUSH_CHECK_INTERVAL = 60
+BOARD_TIMEOUT = 10
+POLL_DEADLINE = 20  # seconds the whole board poll may take before we give up on the slow boards
 
-# configure retry strategy for requests
-retry_strategy = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-http = requests.Session()
-http.mount("http://", HTTPAdapter(max_retries=retry_strategy))
+# boards with thermometers of the site, mapping the XML tags of each board to our columns (see sites.json)
+BOARDS = {board['name']: (board['url'], {sensor['tag']: sensor['column'] for sensor in board['sensors']})
+          for board in registry.BOARDS}
 
+# boards are polled in parallel - the extra workers absorb a board that is still retrying from the last cycle
+board_pool = ThreadPoolExecutor(max_workers=2 * len(BOARDS), thread_name_prefix='board')
+# one persistent connection pool per board and one for the weather API, each as big as the requests that
+# may run against it at once: two per board (see board_pool), the two weather requests
+http = http_client.new_session(hosts=len(BOARDS) + 1, per_host=2)
 
-# fetch temperature data from specified URLs - based on boards with thermometers
-def fetch_temperatures():
-    urls = {
-        'Board 1': 'http://mirabella.gotdns.com:81/status.xml',
-        'Board 2': 'http://mirabella.gotdns.com:83/status.xml',
-        'Board 3': 'http://mirabella.gotdns.com:82/status.xml'
-    }
-    temperatures = {}
 
-    try:
-        for board, url in urls.items():
-            response = http.get(url, timeout=10)
-            response.raise_for_status()
-            root = ET.fromstring(response.content)
-
-            if board == 'Board 1':
-                temperatures['temp_1'] = float(root.find('Temperature1').text.replace('°C', ''))
-                temperatures['temp_2'] = float(root.find('Temperature2').text.replace('°C', ''))
-            elif board == 'Board 2':
-                temperatures['temp_3'] = float(root.find('Temperature1').text.replace('°C', ''))
-                temperatures['temp_4'] = float(root.find('Temperature2').text.replace('°C', ''))
-            elif board == 'Board 3':
-                temperatures['temp_5'] = float(root.find('Temperature2').text.replace('°C', ''))
-                temperatures['temp_6'] = float(root.find('Temperature1').text.replace('°C', ''))
-
-        return temperatures
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching temperature data: {e}")
-        return None
+# cached weather API responses, url -> {'fetched_at': epoch seconds, 'data': json}
+weather_cache = {}
+weather_cache_lock = threading.Lock()
+weather_refreshing = set()
+weather_pool = ThreadPoolExecutor(max_workers=len(WEATHER_TTL), thread_name_prefix='weather')
 
 
-# fetch current weather data from openweathermap API
-def get_weather_data():
+# load the weather cache persisted by a previous run, so restarts don't re-fetch
+def load_weather_cache():
+    weather_cache.update(storage.load_json(WEATHER_CACHE_FILE, {}))
+
+
+# call the openweathermap API and store the response in the cache
+def refresh_weather(url):
     params = {
         'lat': LATITUDE,
         'lon': LONGITUDE,
@@ -67,94 +77,187 @@ def get_weather_data():
         'units': 'metric'
     }
     try:
-        response = http.get(WEATHER_CURRENT_URL, params=params)
-        response.raise_for_status()
-        weather_data = response.json()
-
-        current_temp = weather_data['main']['temp']
-        current_humidity = weather_data['main']['humidity']
-        current_cloudiness = weather_data['clouds']['all']
-        sunrise_utc = datetime.fromtimestamp(weather_data['sys']['sunrise'], pytz.utc)
-        sunset_utc = datetime.fromtimestamp(weather_data['sys']['sunset'], pytz.utc)
-
-        return {
-            'current_temp': current_temp,
-            'current_humidity': current_humidity,
-            'current_cloudiness': current_cloudiness,
-            'current_sunrise': sunrise_utc.astimezone(ATHENS_TZ).isoformat(),
-            'current_sunset': sunset_utc.astimezone(ATHENS_TZ).isoformat()
-        }
+        with metrics.timed('collector_weather_request_seconds', {'url': url}):
+            response = http.get(url, params=params, timeout=WEATHER_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching weather data: {e}")
+        metrics.inc('collector_weather_requests_total', {'url': url, 'status': 'error'})
+        print(f"Error fetching weather data from {url}: {e}")
         return None
+    finally:
+        weather_refreshing.discard(url)
+    metrics.inc('collector_weather_requests_total', {'url': url, 'status': 'ok'})
 
+    with weather_cache_lock:
+        weather_cache[url] = {'fetched_at': time.time(), 'data': data}
+        storage.save_json(WEATHER_CACHE_FILE, weather_cache)
+    return data
 
-# fetch average cloudiness from openweathermap during daylight hours for the next 3 days
-def fetch_average_cloudiness():
-    params = {
-        'lat': LATITUDE,
-        'lon': LONGITUDE,
-        'appid': WEATHER_API_KEY,
-        'units': 'metric'
-    }
-    try:
-        # Requesting forecast data
-        response = http.get(WEATHER_FORECAST_URL, params=params)
-        response.raise_for_status()
-        forecast_data = response.json()
 
-        now = datetime.now(pytz.utc).astimezone(ATHENS_TZ)
-        three_days_later = now + timedelta(days=3)
-        cloudiness_values = []
+# refresh a weather API response in the background, unless a refresh of it is already running
+def revalidate_weather(url):
+    with weather_cache_lock:
+        if url in weather_refreshing:
+            return
+        weather_refreshing.add(url)
+    weather_pool.submit(refresh_weather, url)
 
-        # Retrieving city-wide sunrise and sunset timestamps for the location
-        city_sunrise = datetime.fromtimestamp(forecast_data['city']['sunrise'], pytz.utc).astimezone(ATHENS_TZ)
-        city_sunset = datetime.fromtimestamp(forecast_data['city']['sunset'], pytz.utc).astimezone(ATHENS_TZ)
 
-        # Loop through forecast data entries
-        for entry in forecast_data['list']:
-            forecast_time = datetime.fromtimestamp(entry['dt'], pytz.utc).astimezone(ATHENS_TZ)
+# get a weather API response through the cache (stale-while-revalidate):
+# fresh entries are served as is, stale ones are served while a refresh runs in the background,
+# and only a missing or too old entry makes us wait for the API
+# the scheduled refreshes normally keep the entries fresh, so a sample does not wait for the API
+def get_cached_weather(url):
+    entry = weather_cache.get(url)
+    age = time.time() - entry['fetched_at'] if entry else None
+    if entry is None or age > WEATHER_MAX_STALE[url]:
+        metrics.inc('collector_weather_cache_total', {'url': url, 'result': 'miss'})
+        return refresh_weather(url)
+    stale = age > WEATHER_TTL[url] + WEATHER_JITTER
+    metrics.inc('collector_weather_cache_total', {'url': url, 'result': 'stale' if stale else 'fresh'})
+    if stale:
+        revalidate_weather(url)
+    return entry['data']
 
-            # Include forecast only if within the next 3 days and during daylight hours
-            if now <= forecast_time <= three_days_later:
-                if city_sunrise.time() <= forecast_time.time() <= city_sunset.time():
-                    cloudiness_values.append(entry['clouds']['all'])
 
-        # Return average cloudiness or None if no values were found
-        return {'three_day_forecast_avg': sum(cloudiness_values) / len(cloudiness_values)} if cloudiness_values else None
+# fetch the temperatures of a single board
+def fetch_board(url, tags):
+    with metrics.timed('collector_board_poll_seconds', {'url': url}):
+        texts = http_client.fetch_tags(http, url, tags, BOARD_TIMEOUT)
+    return {column: float(texts[tag].replace('°C', '')) for tag, column in tags.items()}
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching cloudiness forecast data: {e}")
+
+# fetch temperature data from all boards concurrently, keeping the readings of the boards that answered
+# returns the temperatures (None for sensors of failed boards) and the status of every board
+def fetch_temperatures():
+    temperatures = {column: None for _, tags in BOARDS.values() for column in tags.values()}
+    futures = {board: board_pool.submit(fetch_board, url, tags) for board, (url, tags) in BOARDS.items()}
+    wait(futures.values(), timeout=POLL_DEADLINE)
+
+    board_status = {}
+    for board, future in futures.items():
+        if not future.done():
+            future.cancel()
+            board_status[board] = 'timeout'
+            print(f"Error fetching temperature data from {board}: no answer within {POLL_DEADLINE}s")
+        else:
+            try:
+                temperatures.update(future.result())
+                board_status[board] = 'ok'
+            except (requests.exceptions.RequestException, ValueError) as e:
+                board_status[board] = 'error'
+                print(f"Error fetching temperature data from {board}: {e}")
+        metrics.inc('collector_board_polls_total', {'url': BOARDS[board][0], 'status': board_status[board]})
+
+    return temperatures, board_status
+
+
+# fetch current weather data from openweathermap API
+def get_weather_data():
+    weather_data = get_cached_weather(WEATHER_CURRENT_URL)
+    if weather_data is None:
         return None
 
+    current_temp = weather_data['main']['temp']
+    current_humidity = weather_data['main']['humidity']
+    current_cloudiness = weather_data['clouds']['all']
+    sunrise_utc = datetime.fromtimestamp(weather_data['sys']['sunrise'], pytz.utc)
+    sunset_utc = datetime.fromtimestamp(weather_data['sys']['sunset'], pytz.utc)
+
+    return {
+        'current_temp': current_temp,
+        'current_humidity': current_humidity,
+        'current_cloudiness': current_cloudiness,
+        'current_sunrise': sunrise_utc.astimezone(ATHENS_TZ).isoformat(),
+        'current_sunset': sunset_utc.astimezone(ATHENS_TZ).isoformat()
+    }
 
-# append new data to CSV file
-def save_to_csv(data):
-    timestamp = datetime.now(pytz.utc).astimezone(ATHENS_TZ).isoformat()
-    data['timestamp'] = timestamp
 
-    if os.path.exists(CSV_FILE):
-        df = pd.read_csv(CSV_FILE)
-    else:
-        df = pd.DataFrame(columns=['timestamp', 'temp_1', 'temp_2', 'temp_3', 'temp_4', 'temp_5', 'temp_6',
-                                   'current_cloudiness', 'current_temp', 'current_humidity',
-                                   'current_sunrise', 'current_sunset', 'three_day_forecast_avg'])
+# fetch average cloudiness from openweathermap during daylight hours for the next 3 days
+def fetch_average_cloudiness():
+    forecast_data = get_cached_weather(WEATHER_FORECAST_URL)
+    if forecast_data is None:
+        return None
 
-    df = pd.concat([df, pd.DataFrame([data])], ignore_index=True)
-    df.to_csv(CSV_FILE, index=False)
+    now = datetime.now(pytz.utc).astimezone(ATHENS_TZ)
+    three_days_later = now + timedelta(days=3)
+    cloudiness_values = []
 
+    # Retrieving city-wide sunrise and sunset timestamps for the location
+    city_sunrise = datetime.fromtimestamp(forecast_data['city']['sunrise'], pytz.utc).astimezone(ATHENS_TZ)
+    city_sunset = datetime.fromtimestamp(forecast_data['city']['sunset'], pytz.utc).astimezone(ATHENS_TZ)
 
-# main loop to fetch and save data every 2 minutes
-def main():
-    while True:
-        temps = fetch_temperatures()
-        if temps:
+    # Loop through forecast data entries
+    for entry in forecast_data['list']:
+        forecast_time = datetime.fromtimestamp(entry['dt'], pytz.utc).astimezone(ATHENS_TZ)
+
+        # Include forecast only if within the next 3 days and during daylight hours
+        if now <= forecast_time <= three_days_later:
+            if city_sunrise.time() <= forecast_time.time() <= city_sunset.time():
+                cloudiness_values.append(entry['clouds']['all'])
+
+    # Return average cloudiness or None if no values were found
+    return {'three_day_forecast_avg': sum(cloudiness_values) / len(cloudiness_values)} if cloudiness_values else None
+
+
+# timestamp a new sample and append it to the store - the rollups and co-moments
+# are updated from it in batches by the journal
+def save_sample(data, sampled_at):
+    data['timestamp'] = sampled_at.isoformat()
+    with metrics.timed('collector_write_seconds', {'stage': 'log'}):
+        storage.append_sample(data)
+    # the dashboard picks the sample up from shared memory, it is already on disk for everything else
+    with metrics.timed('collector_write_seconds', {'stage': 'feed'}):
+        feed.publish(data)
+    journal.add(data)
+    metrics.set_gauge('collector_last_sample_timestamp_seconds', sampled_at.timestamp())
+
+
+# poll the boards and store a sample with the cached weather - job of the scheduler, on every tick of SAMPLE_INTERVAL
+def sample(tick):
+    # stamp the sample with the time the boards were polled, not when the weather calls returned
+    sampled_at = datetime.now(pytz.utc).astimezone(ATHENS_TZ)
+    saved = False
+    with metrics.timed('collector_cycle_seconds'):
+        temps, board_status = fetch_temperatures()
+        if 'ok' in board_status.values():
             weather_data = get_weather_data()
             forecast = fetch_average_cloudiness()
             if weather_data and forecast:
                 combined_data = {**temps, **weather_data, **forecast}
-                save_to_csv(combined_data)
-        time.sleep(300)
+                save_sample(combined_data, sampled_at)
+                saved = True
+    metrics.inc('collector_samples_total', {'result': 'saved' if saved else 'skipped'})
+    # every poll goes through the alarm detector, also the ones without sample, so a board that stopped
+    # answering is noticed
+    with metrics.timed('collector_write_seconds', {'stage': 'alarms'}):
+        alarms.update(temps, sampled_at)
+
+
+def compact(tick):
+    with metrics.timed('collector_write_seconds', {'stage': 'compaction'}):
+        storage.compact_segments()
+
+
+# main loop: sample the boards, refresh the weather and compact the store, each on its own schedule
+def main():
+    storage.migrate_csv()
+    journal.recover()
+    alarms.recover()
+    load_weather_cache()
+    feed.open_writer()
+    # models are refitted in the background, so a slow fit never delays a poll
+    threading.Thread(target=forecasting.main, daemon=True).start()
+    metrics.start_server()
+    # a late sample is skipped rather than taken twice in a row, the weather is refreshed in the background
+    scheduler.run([
+        scheduler.new_job('sample', sample, SAMPLE_INTERVAL),
+        *[scheduler.new_job(f"weather {url.rsplit('/', 1)[-1]}", lambda tick, url=url: revalidate_weather(url),
+                            WEATHER_TTL[url], jitter=WEATHER_JITTER) for url in WEATHER_TTL],
+        scheduler.new_job('compaction', compact, COMPACTION_INTERVAL, offset=COMPACTION_OFFSET, run_at_start=True),
+        scheduler.new_job('flush', journal.flush_due, FLUSH_CHECK_INTERVAL),
+    ])
 
 
 if __name__ == "__main__":
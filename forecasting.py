@@ -0,0 +1,115 @@
+import os
+import warnings
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import storage
+import rollups
+
+# constants
+FORECAST_DIR = os.path.join(storage.DATA_DIR, 'forecasts')
+FORECAST_FILE = os.path.join(FORECAST_DIR, 'forecasts.json')
+MODEL_FILE = os.path.join(FORECAST_DIR, 'models.json')
+# seconds between two refits of the models, and how many seconds past the hour they start
+FORECAST_INTERVAL = 3600
+FORECAST_OFFSET = 600
+# models are fitted on the hourly means of the last two weeks, with a daily seasonal term for the heating cycle
+TRAINING_HOURS = 14 * 24
+FORECAST_ORDER = (1, 0, 1)
+FORECAST_SEASONAL_ORDER = (1, 0, 0, 24)
+FORECAST_HOURS = 12
+# the band drawn around the forecast covers 80% of the expected outcomes
+FORECAST_ALPHA = 0.2
+# forecasts older than this are no longer shown by the app, e.g. when the worker stopped
+FORECAST_MAX_AGE = timedelta(hours=3)
+
+
+# hourly means of a sensor over the last TRAINING_HOURS closed hours, with missing hours as NaN
+def training_series(hourly, col):
+    series = hourly.set_index('timestamp')[col]
+    # the newest bucket is still open and would pull the last hour towards its first few samples
+    series = series.iloc[:-1]
+    if series.dropna().empty:
+        return None
+    end = series.index[-1]
+    index = pd.date_range(end=end.tz_convert('UTC'), periods=TRAINING_HOURS, freq='h').tz_convert(storage.ATHENS_TZ)
+    return series.reindex(index)
+
+
+# fit the model of a sensor, warm-started from the parameters of the previous fit when the model is unchanged
+def fit_forecast(series, previous=None):
+    # only the worker needs statsmodels, importing it here keeps it out of the app
+    from statsmodels.tsa.arima.model import ARIMA
+
+    model = ARIMA(series.to_numpy(), order=FORECAST_ORDER, seasonal_order=FORECAST_SEASONAL_ORDER)
+    start_params = None
+    if previous and previous['order'] == [*FORECAST_ORDER, *FORECAST_SEASONAL_ORDER]:
+        start_params = np.array(previous['params'])
+    with warnings.catch_warnings():
+        # the optimizer warns about convergence on flat stretches, the fit is still usable
+        warnings.simplefilter('ignore')
+        result = model.fit(start_params=start_params)
+
+    prediction = result.get_forecast(FORECAST_HOURS)
+    bounds = prediction.conf_int(alpha=FORECAST_ALPHA)
+    # hourly means stand for the middle of their hour
+    timestamps = [series.index[-1] + timedelta(hours=hours, minutes=30) for hours in range(1, FORECAST_HOURS + 1)]
+    forecast = {'timestamp': [ts.isoformat() for ts in timestamps],
+                'mean': prediction.predicted_mean.tolist(),
+                'lower': bounds[:, 0].tolist(),
+                'upper': bounds[:, 1].tolist()}
+    model_state = {'order': [*FORECAST_ORDER, *FORECAST_SEASONAL_ORDER], 'params': result.params.tolist(),
+                   'trained_until': series.index[-1].isoformat()}
+    return forecast, model_state
+
+
+# refit the models of all sensors on the hourly rollup and persist the models and their forecasts
+def run_forecasts():
+    hourly = rollups.load_rollup('hourly')
+    if hourly is None or len(hourly) < 2:
+        return
+
+    models = storage.load_json(MODEL_FILE, {})
+    forecasts = {}
+    for col in storage.SENSOR_COLUMNS:
+        series = training_series(hourly, col)
+        if series is None:
+            continue
+        previous = models.get(col)
+        if previous and previous['trained_until'] == series.index[-1].isoformat():
+            # no hour was closed since the last fit
+            continue
+        try:
+            forecasts[col], models[col] = fit_forecast(series, previous)
+        except Exception as e:
+            print(f"Error forecasting {col}: {e}")
+
+    if forecasts:
+        os.makedirs(FORECAST_DIR, exist_ok=True)
+        storage.save_json(MODEL_FILE, models)
+        current = storage.load_json(FORECAST_FILE, {}).get('columns', {})
+        storage.save_json(FORECAST_FILE, {'generated_at': datetime.now(storage.ATHENS_TZ).isoformat(),
+                                          'columns': {**current, **forecasts}})
+
+
+# the forecasts of the worker, or None when there are none or they are too old to show
+def load_forecasts():
+    forecasts = storage.load_json(FORECAST_FILE)
+    if forecasts is None:
+        return None
+    if datetime.now(storage.ATHENS_TZ) - datetime.fromisoformat(forecasts['generated_at']) > FORECAST_MAX_AGE:
+        return None
+    return forecasts['columns']
+
+
+# forecasting stage, runs next to the collector in a background thread or on its own
+# the models are refitted right away and then a few minutes after every hour, once the hour's rollup is closed
+def main():
+    # not needed by the app, which imports this module for load_forecasts
+    import scheduler
+    scheduler.run([scheduler.new_job('forecasting', lambda tick: run_forecasts(), FORECAST_INTERVAL,
+                                     offset=FORECAST_OFFSET, run_at_start=True)])
+
+
+if __name__ == "__main__":
+    main()
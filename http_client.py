@@ -0,0 +1,89 @@
+import re
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+# constants
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 1
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# bytes read from a board per chunk - a status.xml usually arrives in one or two
+BOARD_CHUNK_SIZE = 2048
+# once the tags are found, a rest of the body up to this size is still read, so the connection can be reused -
+# dropping the connection of a bigger body is cheaper than downloading it
+BOARD_DRAIN_BYTES = 64 * 1024
+# the encoding in the declaration at the start of an xml document, utf-8 when there is none
+XML_DECLARATION = re.compile(rb'(?:\xef\xbb\xbf)?<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+
+
+# retry strategy that counts its retries per host in the metrics
+class CountingRetry(Retry):
+    def increment(self, *args, **kwargs):
+        # raises once the retries are used up, so only retries that actually happen are counted
+        retry = super().increment(*args, **kwargs)
+        pool = kwargs.get('_pool')
+        metrics.inc('collector_http_retries_total', {'host': f"{pool.host}:{pool.port}" if pool else 'unknown'})
+        return retry
+
+
+# session keeping persistent connections to every host, with retries on http and https alike
+# hosts is the number of hosts (every board counts as one, as its port tells it apart), per_host the number of
+# requests that may run against a host at the same time
+def new_session(hosts, per_host):
+    retry_strategy = CountingRetry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF, status_forcelist=RETRY_STATUSES)
+    adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=per_host, max_retries=retry_strategy)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# decode the text of a tag in the encoding the document declares, like an xml parser would - the boards
+# may send their °C in latin-1 - raises ValueError for an encoding python does not know
+def _decode(content, text):
+    match = XML_DECLARATION.match(content)
+    encoding = match.group(1).decode() if match else 'utf-8'
+    try:
+        return text.decode(encoding)
+    except LookupError:
+        raise ValueError(f"Unknown encoding {encoding} of the response")
+
+
+# the text of the given tags of an xml document streamed in chunks, without parsing the document:
+# the chunks are only read until every tag was seen - raises ValueError when a tag is missing
+def extract_tags(chunks, tags):
+    wanted = {tag: (f"<{tag}>".encode(), f"</{tag}>".encode()) for tag in tags}
+    # where to look for the opening tag of every tag next
+    positions = dict.fromkeys(tags, 0)
+    found, content = {}, bytearray()
+    for chunk in chunks:
+        content += chunk
+        for tag, (start, end) in list(wanted.items()):
+            first = content.find(start, positions[tag])
+            if first < 0:
+                # the opening tag may be cut at the end of the chunk
+                positions[tag] = max(len(content) - len(start) + 1, 0)
+                continue
+            positions[tag] = first
+            last = content.find(end, first + len(start))
+            if last >= 0:
+                found[tag] = _decode(content, bytes(content[first + len(start):last]))
+                del wanted[tag]
+        if not wanted:
+            return found
+    raise ValueError(f"Missing {', '.join(wanted)} in the response")
+
+
+# get the text of the tags of a board's status.xml through a session, reading no more of it than needed
+# - the rest of a body of unknown length is not read, which costs its connection
+def fetch_tags(session, url, tags, timeout):
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        chunks = response.iter_content(BOARD_CHUNK_SIZE)
+        found = extract_tags(chunks, tags)
+        remaining = int(response.headers.get('Content-Length', 0)) - response.raw.tell()
+        if 0 < remaining <= BOARD_DRAIN_BYTES:
+            for _ in chunks:
+                pass
+    return found
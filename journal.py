@@ -0,0 +1,100 @@
+import os
+import time
+import pandas as pd
+import registry
+import schema
+import storage
+import rollups
+import correlations
+import alarms
+import metrics
+
+# constants
+# the day logs of the store are the journal of the collector: every sample is appended and synced to disk
+# on its own, while the stores derived from it (rollups, co-moment blocks) are updated
+# in batches - the checkpoint records the last sample they contain, so a restart replays the samples after it
+CHECKPOINT_FILE = os.path.join(storage.DATA_DIR, 'checkpoint.json')
+# buffered samples are folded into the derived stores once there are this many, or the oldest is as old as a
+# full batch would be - so a collector whose samples stop or are skipped still flushes what it has
+FLUSH_SAMPLES = 10
+FLUSH_SECONDS = FLUSH_SAMPLES * registry.SAMPLE_INTERVAL
+
+# samples in the logs but not yet in the derived stores, and when the first of them was buffered
+_pending = []
+_pending_since = None
+
+
+# buffer a sample that was appended to the store, flushing the buffer when it is due
+def add(sample):
+    global _pending_since
+    if not _pending:
+        _pending_since = time.monotonic()
+    _pending.append(sample)
+    if len(_pending) >= FLUSH_SAMPLES or time.monotonic() - _pending_since >= FLUSH_SECONDS:
+        flush()
+
+
+# flush the buffer once its oldest sample waited long enough - job of the scheduler, for when the
+# samples stop coming
+def flush_due(tick=None):
+    if _pending and time.monotonic() - _pending_since >= FLUSH_SECONDS:
+        flush()
+
+
+# fold the buffered samples into the derived stores - the checkpoint is marked while they are being
+# written, so a flush cut short by a crash is noticed by recover
+def flush():
+    global _pending
+    if not _pending:
+        return
+    samples, _pending = _pending, []
+    checkpoint = storage.load_json(CHECKPOINT_FILE, {})
+    storage.save_json(CHECKPOINT_FILE, {**checkpoint, 'flushing': samples[-1]['timestamp']})
+    with metrics.timed('collector_write_seconds', {'stage': 'rollups'}):
+        rollups.update_rollups(samples)
+    with metrics.timed('collector_write_seconds', {'stage': 'correlations'}):
+        correlations.update_correlations(samples)
+    # the alarm detector runs on every poll, its state is saved along with the derived stores
+    with metrics.timed('collector_write_seconds', {'stage': 'alarm_state'}):
+        alarms.save_state()
+    storage.save_json(CHECKPOINT_FILE, {'applied_until': samples[-1]['timestamp']})
+
+
+# a stored row as the sample dict the collector wrote, with the sunrise and sunset of its day
+def _sample_from_row(row, sun):
+    sample = {col: None if storage.is_missing(value) else value for col, value in row.items()}
+    sample['timestamp'] = row['timestamp'].isoformat()
+    day = row['timestamp'].normalize()
+    for col, name in schema.SUN_COLUMNS.items():
+        sample[col] = sun.at[day, name].isoformat() if day in sun.index and pd.notna(sun.at[day, name]) else None
+    return sample
+
+
+# bring the derived stores up to date with the store after a restart, called by the collector before its
+# first sample: repairs a log line torn by a power cut and replays the samples written after the checkpoint
+# - after a flush that was cut short, some of its samples may be in a derived store already, which is
+# then rebuilt instead
+def recover():
+    storage.repair_logs()
+    df = storage.load_samples()
+    if df.empty:
+        return
+    last = df['timestamp'].iloc[-1].isoformat()
+    checkpoint = storage.load_json(CHECKPOINT_FILE)
+
+    if checkpoint is None:
+        # derived stores written before the checkpoint existed were updated with every sample
+        storage.save_json(CHECKPOINT_FILE, {'applied_until': last})
+    elif 'flushing' in checkpoint:
+        print(f"Error in the last flush until {checkpoint['flushing']}: rebuilding the derived stores")
+        rollups.rebuild_rollups()
+        correlations.rebuild_correlations()
+        storage.save_json(CHECKPOINT_FILE, {'applied_until': last})
+    else:
+        applied_until = pd.Timestamp(checkpoint['applied_until'])
+        replay = df.iloc[df['timestamp'].searchsorted(applied_until, side='right'):]
+        if not replay.empty:
+            print(f"Replaying {len(replay)} samples stored after {checkpoint['applied_until']}")
+            sun = storage.load_sun()
+            _pending.extend(_sample_from_row(row, sun) for row in replay.to_dict('records'))
+            flush()
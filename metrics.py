@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# constants
+# the endpoint only listens locally by default, set METRICS_PORT=0 to turn it off
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30]
+
+# metrics of the collector, name -> (type, help)
+METRICS = {
+    'collector_board_poll_seconds': ('histogram', "Time to poll a board, including retries."),
+    'collector_board_polls_total': ('counter', "Board polls by outcome (ok, timeout, error)."),
+    'collector_http_retries_total': ('counter', "HTTP retries per host."),
+    'collector_weather_request_seconds': ('histogram', "Time of a weather API request, including retries."),
+    'collector_weather_requests_total': ('counter', "Weather API requests by outcome (ok, error)."),
+    'collector_weather_cache_total': ('counter', "Weather cache lookups by result (fresh, stale, miss)."),
+    'collector_write_seconds': ('histogram', "Time of a storage write by stage."),
+    'collector_samples_total': ('counter', "Poll cycles by result (saved, skipped)."),
+    'collector_cycle_seconds': ('histogram', "Time from the start of a poll cycle until its sample is stored."),
+    'collector_cycle_drift_seconds': ('gauge', "How much later than its tick the last run of a job started."),
+    'collector_scheduler_ticks_total': ('counter', "Ticks of a job by result (run, skipped)."),
+    'collector_last_sample_timestamp_seconds': ('gauge', "Unix time of the last stored sample."),
+    'collector_alarm_events_total': ('counter', "Alarms raised and cleared by kind (high, low, rate, stuck, offline)."),
+    'collector_alarms_active': ('gauge', "Alarms currently raised."),
+}
+
+# current values, name -> {labels: value}, histograms hold [count per bucket..., sum, count] per labels
+_lock = threading.Lock()
+_values = {name: {} for name in METRICS}
+
+
+def _key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def inc(name, labels=None, value=1):
+    with _lock:
+        series = _values[name]
+        key = _key(labels)
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name, value, labels=None):
+    with _lock:
+        _values[name][_key(labels)] = value
+
+
+def observe(name, seconds, labels=None):
+    with _lock:
+        series = _values[name]
+        key = _key(labels)
+        if key not in series:
+            series[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+        counts = series[key]
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                counts[index] += 1
+                break
+        counts[-2] += seconds
+        counts[-1] += 1
+
+
+# observe the duration of a block in a histogram, also when it raises
+@contextmanager
+def timed(name, labels=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, labels)
+
+
+def _format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    escaped = [(label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for label, value in pairs]
+    return '{' + ','.join(f'{label}="{value}"' for label, value in escaped) + '}'
+
+
+# all metrics in the prometheus text exposition format
+def render():
+    lines = []
+    with _lock:
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for key, value in _values[name].items():
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {value[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # scrapes are frequent, keep them out of the collector's output
+    def log_message(self, format, *args):
+        pass
+
+
+# serve /metrics from a background thread - a busy port only costs us the endpoint, not the collector
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Error starting metrics endpoint on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    return server
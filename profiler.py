@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+
+# constants
+# profiling is on for every session with PROFILE_RENDER=1, or for a single session with ?profile=1
+PROFILE_ENV = 'PROFILE_RENDER'
+PROFILE_QUERY_PARAM = 'profile'
+# optional json lines log of every profiled rerun, rotated to a single .1 backup when it gets too big
+PROFILE_LOG_FILE = os.getenv('PROFILE_LOG')
+PROFILE_LOG_MAX_BYTES = 5 * 1024 * 1024
+
+# every session reruns the script in its own thread, so the current run is kept per thread
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def is_enabled():
+    return os.getenv(PROFILE_ENV, '') not in ('', '0') or st.query_params.get(PROFILE_QUERY_PARAM) == '1'
+
+
+# start profiling a rerun of the script, does nothing unless profiling is enabled
+def start_run():
+    _local.run = {'started': time.perf_counter(), 'stages': [], 'open': []} if is_enabled() else None
+
+
+# time a stage of the rerun, stages opened inside it are shown nested below it
+@contextmanager
+def stage(name):
+    run = getattr(_local, 'run', None)
+    if run is None:
+        yield
+        return
+    entry = {'stage': name, 'depth': len(run['open']), 'ms': 0.0, 'figure_bytes': 0}
+    run['stages'].append(entry)
+    run['open'].append(entry)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry['ms'] = (time.perf_counter() - start) * 1000
+        run['open'].pop()
+
+
+# st.plotly_chart that also records the size of the figure json sent to the browser
+def plotly_chart(fig, **kwargs):
+    run = getattr(_local, 'run', None)
+    if run is not None and run['open']:
+        import plotly.io as pio
+        run['open'][-1]['figure_bytes'] += len(pio.to_json(fig, validate=False))
+    return st.plotly_chart(fig, **kwargs)
+
+
+def _write_log(record):
+    with _log_lock:
+        try:
+            if os.path.exists(PROFILE_LOG_FILE) and os.path.getsize(PROFILE_LOG_FILE) > PROFILE_LOG_MAX_BYTES:
+                os.replace(PROFILE_LOG_FILE, PROFILE_LOG_FILE + '.1')
+            with open(PROFILE_LOG_FILE, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            print(f"Error writing render profile to {PROFILE_LOG_FILE}: {e}")
+
+
+# finish the profiled rerun: show the breakdown panel and append the run to the log
+# context is stored with the run in the log, e.g. the selected time range
+def finish_run(**context):
+    run = getattr(_local, 'run', None)
+    _local.run = None
+    if run is None:
+        return
+    total_ms = (time.perf_counter() - run['started']) * 1000
+    stages = run['stages']
+
+    with st.expander("Render profile", expanded=True):
+        st.dataframe(pd.DataFrame({
+            # em spaces, plain ones are trimmed by the table
+            'Stage': ['\u2003' * entry['depth'] + '└ ' * bool(entry['depth']) + entry['stage']
+                      for entry in stages],
+            'Time (ms)': [round(entry['ms'], 1) for entry in stages],
+            'Share (%)': [round(100 * entry['ms'] / total_ms, 1) for entry in stages],
+            'Figures (kB)': [round(entry['figure_bytes'] / 1000, 1) if entry['figure_bytes'] else None
+                             for entry in stages],
+        }), hide_index=True, use_container_width=True)
+        figure_bytes = sum(entry['figure_bytes'] for entry in stages)
+        st.caption(f"Rerun took {total_ms:.0f} ms and sent {figure_bytes / 1000:.0f} kB of figures.")
+
+    if PROFILE_LOG_FILE:
+        _write_log({'at': datetime.now().astimezone().isoformat(), 'total_ms': round(total_ms, 3), **context,
+                    'stages': [{**entry, 'ms': round(entry['ms'], 3)} for entry in stages]})
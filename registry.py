@@ -0,0 +1,83 @@
+import json
+import os
+
+# constants
+REGISTRY_DIR = os.path.dirname(os.path.abspath(__file__))
+# sites with their boards and sensors, see sites.json
+SITES_FILE = os.getenv('SITES_FILE', os.path.join(REGISTRY_DIR, 'sites.json'))
+# columns of every sample that do not come from the boards, sensors may not use them
+WEATHER_COLUMNS = ['current_cloudiness', 'current_temp', 'current_humidity',
+                   'current_sunrise', 'current_sunset', 'three_day_forecast_avg']
+# alarm thresholds of sites, boards and sensors that do not set their own: min and max in °C, max_rate in °C
+# per minute, a sensor is stuck once its reading has not changed for stuck_minutes and a board offline once
+# it has not answered for offline_minutes
+DEFAULT_ALARMS = {'min': 20, 'max': 100, 'max_rate': 3, 'stuck_minutes': 180, 'offline_minutes': 15}
+# keys without default that every site, board and sensor must set
+REQUIRED_KEYS = {'site': ['latitude', 'longitude', 'weather_city_id', 'weather_city', 'boards'],
+                 'board': ['name', 'url', 'sensors'],
+                 'sensor': ['tag', 'column']}
+
+
+# raise when entry, a site, board or sensor of the registry described by where, misses a required key
+def _require(entry, kind, where):
+    missing = [key for key in REQUIRED_KEYS[kind] if key not in entry]
+    if missing:
+        raise ValueError(f"{where} misses {', '.join(missing)}")
+
+
+# raise when the data directory of a site is the one of another site or inside it, where their stores
+# would mix (the rollups, alarms, forecasts and correlations of a site are subdirectories of its own)
+def _check_data_dirs(sites):
+    dirs = {site_id: os.path.normpath(site['data_dir']) for site_id, site in sites.items()}
+    for site_id, path in dirs.items():
+        for other_id, other in dirs.items():
+            if other_id != site_id and (path == other or path.startswith(other + os.sep)):
+                raise ValueError(f"Data directory {path} of site {site_id} is inside the one of site {other_id}")
+
+
+# load the sites of the registry: site id -> site, with the boards and their sensors completed by their
+# alarm thresholds (a sensor inherits those of its board, a board those of its site)
+# every site stores its data in a directory of its own, data_<site> next to data/ by default, and only a site
+# that sets legacy_csv has a single-file csv from before the day segments to migrate
+def load_sites(path=SITES_FILE):
+    with open(path) as f:
+        sites = json.load(f)
+    for site_id, site in sites.items():
+        _require(site, 'site', f"Site {site_id}")
+        site.setdefault('name', site_id)
+        site.setdefault('data_dir', f"data_{site_id}")
+        site.setdefault('legacy_csv', None)
+        site['alarms'] = {**DEFAULT_ALARMS, **site.get('alarms', {})}
+        columns = set()
+        for index, board in enumerate(site['boards']):
+            _require(board, 'board', f"Board {board.get('name', index + 1)} of site {site_id}")
+            board.setdefault('label', board['name'])
+            board['alarms'] = {**site['alarms'], **board.get('alarms', {})}
+            for sensor in board['sensors']:
+                _require(sensor, 'sensor', f"Sensor {sensor.get('column', sensor.get('tag', '?'))} of {board['name']}")
+                if sensor['column'] in columns or sensor['column'] in ['timestamp', *WEATHER_COLUMNS]:
+                    raise ValueError(f"Column {sensor['column']} of {board['name']} is already used in site {site_id}")
+                columns.add(sensor['column'])
+                sensor.setdefault('room', sensor['column'])
+                sensor['board'] = board['name']
+                sensor['alarms'] = {**board['alarms'], **sensor.get('alarms', {})}
+        if len({board['name'] for board in site['boards']}) != len(site['boards']):
+            raise ValueError(f"Board names of site {site_id} are not unique")
+    _check_data_dirs(sites)
+    return sites
+
+
+SITES = load_sites()
+# every process serves a single site, the first one of the registry unless SITE is set
+SITE_ID = os.getenv('SITE', next(iter(SITES)))
+if SITE_ID not in SITES:
+    raise ValueError(f"Unknown site {SITE_ID}, {SITES_FILE} has {', '.join(SITES)}")
+SITE = SITES[SITE_ID]
+BOARDS = SITE['boards']
+SENSORS = [sensor for board in BOARDS for sensor in board['sensors']]
+SENSOR_COLUMNS = [sensor['column'] for sensor in SENSORS]
+ROOMS = {sensor['column']: sensor['room'] for sensor in SENSORS}
+# every site is stored in a directory of its own, DATA_DIR overrides the one of the site
+DATA_DIR = os.getenv('DATA_DIR', SITE['data_dir'])
+# seconds between two samples, per site in sites.json (default 300), SAMPLE_INTERVAL overrides it
+SAMPLE_INTERVAL = int(os.getenv('SAMPLE_INTERVAL', SITE.get('sample_interval', 300)))
@@ -0,0 +1,215 @@
+import csv
+import math
+import os
+import threading
+from datetime import datetime, time as dt_time
+import pandas as pd
+import schema
+import storage
+from storage import is_missing
+
+# constants
+ROLLUP_DIR = os.path.join(storage.DATA_DIR, 'rollups')
+ROLLUP_STATE_FILE = os.path.join(ROLLUP_DIR, 'state.json')
+# bucket length in seconds of every rollup level, finest first
+ROLLUP_LEVELS = {'5min': 300, 'hourly': 3600, 'daily': 86400}
+VALUE_COLUMNS = [*storage.SENSOR_COLUMNS,
+                 'current_cloudiness', 'current_temp', 'current_humidity', 'three_day_forecast_avg']
+# text columns are carried over from the last sample of the bucket
+LAST_COLUMNS = ['current_sunrise', 'current_sunset']
+# every value column is rolled up as its mean (under the original name, so rollups can stand in
+# for raw samples) plus min, max, count and standard deviation
+ROLLUP_COLUMNS = ['timestamp',
+                  *[f"{col}{suffix}" for col in VALUE_COLUMNS for suffix in ('', '_min', '_max', '_count', '_std')],
+                  *LAST_COLUMNS]
+# bumped whenever the rollup layout changes, so the collector rebuilds rollups written by an older version
+ROLLUP_VERSION = 2
+
+# open buckets of the collector, level -> bucket (see _new_bucket)
+_state = None
+# rollups loaded by the app, level -> {'stat', 'offset', 'closed', 'state_stat', 'frame'}
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def _rollup_path(level):
+    return os.path.join(ROLLUP_DIR, f"{level}.csv")
+
+
+# start of the bucket of a level that a local timestamp falls in
+def bucket_start(ts, level):
+    if level == 'daily':
+        return storage.ATHENS_TZ.localize(datetime.combine(ts.date(), dt_time()))
+    minutes = ROLLUP_LEVELS[level] // 60
+    return ts.replace(minute=ts.minute - ts.minute % minutes, second=0, microsecond=0)
+
+
+def _new_bucket(start):
+    return {'timestamp': start.isoformat(), 'values': {}, 'last': {}}
+
+
+# add one sample to a bucket: running count, mean, min, max and sum of squared deviations per column
+def _accumulate(bucket, sample):
+    for col in VALUE_COLUMNS:
+        value = sample.get(col)
+        if is_missing(value):
+            continue
+        value = float(value)
+        count, mean, low, high, m2 = bucket['values'].get(col, (0, 0.0, value, value, 0.0))
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        m2 += delta * (value - mean)
+        bucket['values'][col] = (count, mean, min(low, value), max(high, value), m2)
+    for col in LAST_COLUMNS:
+        if not is_missing(sample.get(col)):
+            bucket['last'][col] = sample[col]
+
+
+# flatten a bucket into a row with the ROLLUP_COLUMNS layout
+def _bucket_row(bucket):
+    row = {'timestamp': bucket['timestamp'], **bucket['last']}
+    for col, (count, mean, low, high, m2) in bucket['values'].items():
+        std = math.sqrt(m2 / (count - 1)) if count > 1 else None
+        row.update({col: mean, f"{col}_min": low, f"{col}_max": high, f"{col}_count": count, f"{col}_std": std})
+    return row
+
+
+def _append_bucket(level, bucket):
+    path = _rollup_path(level)
+    is_new = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=ROLLUP_COLUMNS)
+        if is_new:
+            writer.writeheader()
+        writer.writerow(_bucket_row(bucket))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# fold new samples into every rollup level - called by the collector once the samples are stored
+def update_rollups(samples):
+    global _state
+    if _state is None:
+        _state = storage.load_json(ROLLUP_STATE_FILE)
+        if (_state is None or _state.get('version') != ROLLUP_VERSION
+                or _state.get('columns') != VALUE_COLUMNS):
+            # first run, or the sensors of the site changed - the rebuild already covers these samples,
+            # which were stored before calling us
+            _state = rebuild_rollups()
+            return
+
+    for sample in samples:
+        ts = datetime.fromisoformat(sample['timestamp']).astimezone(storage.ATHENS_TZ)
+        for level in ROLLUP_LEVELS:
+            start = bucket_start(ts, level).isoformat()
+            bucket = _state.get(level)
+            if bucket is not None and bucket['timestamp'] != start:
+                # the sample opens a new bucket, so the previous one is final
+                _append_bucket(level, bucket)
+                bucket = None
+            if bucket is None:
+                bucket = _new_bucket(bucket_start(ts, level))
+            _accumulate(bucket, sample)
+            _state[level] = bucket
+    storage.save_json(ROLLUP_STATE_FILE, _state)
+
+
+# recompute all rollups from the stored samples, e.g. after migrating existing history
+# returns the open buckets to continue from
+def rebuild_rollups():
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    df, sun = storage.load_samples(), storage.load_sun()
+    # the samples are loaded without their text columns, which are carried over from the day's sun table
+    sun_text = {col: sun[name].dropna().map(lambda ts: ts.isoformat()) for col, name in schema.SUN_COLUMNS.items()}
+    state = {'version': ROLLUP_VERSION, 'columns': VALUE_COLUMNS}
+    for level in ROLLUP_LEVELS:
+        path = _rollup_path(level)
+        if os.path.exists(path):
+            os.remove(path)
+        if df.empty:
+            continue
+
+        if level == 'daily':
+            starts = df['timestamp'].dt.normalize()
+        else:
+            # Athens is a whole number of hours off UTC, so flooring in UTC avoids the DST ambiguity
+            starts = df['timestamp'].dt.tz_convert('UTC').dt.floor(f"{ROLLUP_LEVELS[level]}s")
+            starts = starts.dt.tz_convert(storage.ATHENS_TZ)
+        grouped = df.groupby(starts, sort=True)
+        rollup = grouped[VALUE_COLUMNS].agg(['mean', 'min', 'max', 'count', 'std'])
+        rollup.columns = [col if stat == 'mean' else f"{col}_{stat}" for col, stat in rollup.columns]
+        for col in LAST_COLUMNS:
+            rollup[col] = sun_text[col].reindex(rollup.index.normalize()).to_numpy()
+        rollup.index = rollup.index.map(lambda ts: ts.isoformat())
+        rollup = rollup.rename_axis('timestamp').reset_index().reindex(columns=ROLLUP_COLUMNS)
+
+        # all but the newest bucket are final, the newest one stays open in the state
+        rollup.iloc[:-1].to_csv(path, index=False)
+        last = rollup.iloc[-1]
+        bucket = {'timestamp': last['timestamp'], 'values': {}, 'last': {}}
+        for col in VALUE_COLUMNS:
+            count = int(last[f"{col}_count"])
+            if count > 0:
+                m2 = float(last[f"{col}_std"]) ** 2 * (count - 1) if count > 1 else 0.0
+                bucket['values'][col] = (count, float(last[col]),
+                                         float(last[f"{col}_min"]), float(last[f"{col}_max"]), m2)
+        for col in LAST_COLUMNS:
+            if not is_missing(last[col]):
+                bucket['last'][col] = last[col]
+        state[level] = bucket
+    storage.save_json(ROLLUP_STATE_FILE, state)
+    return state
+
+
+# size, mtime and inode of a file - the inode tells a rebuilt rollup apart from one that only grew
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+# load a rollup level as a frame shaped like the raw samples, oldest first, including the open bucket
+# returns None when the collector has not produced rollups yet
+def load_rollup(level):
+    with _cache_lock:
+        path = _rollup_path(level)
+        stat, state_stat = _stat(path), _stat(ROLLUP_STATE_FILE)
+        if state_stat is None:
+            return None
+        entry = _cache.get(level)
+        if entry and entry['stat'] == stat and entry['state_stat'] == state_stat:
+            return entry['frame']
+
+        # closed buckets are append-only, so only parse what was added since the last load
+        if stat is None:
+            closed, offset = storage.parse_rows(pd.DataFrame(columns=ROLLUP_COLUMNS), ROLLUP_COLUMNS), 0
+        elif entry and entry['stat'] is not None and entry['stat'][2] == stat[2] and stat[0] >= entry['offset']:
+            tail, consumed = storage.read_log_lines(path, entry['offset'], ROLLUP_COLUMNS)
+            closed, offset = entry['closed'], entry['offset'] + consumed
+            if not tail.empty:
+                closed = pd.concat([closed, tail], ignore_index=True)
+        else:
+            closed, offset = storage.read_log_lines(path, 0, ROLLUP_COLUMNS)
+
+        state = storage.load_json(ROLLUP_STATE_FILE, {})
+        frame = closed
+        if level in state:
+            open_row = storage.parse_rows(pd.DataFrame([_bucket_row(state[level])]), ROLLUP_COLUMNS)
+            # the std of a bucket with a single sample is None, keep the value columns numeric like the csv's
+            value_columns = [col for col in ROLLUP_COLUMNS if col not in ('timestamp', *LAST_COLUMNS)]
+            open_row[value_columns] = open_row[value_columns].astype(float)
+            # the open bucket may have been closed into the csv between our two reads
+            if closed.empty:
+                frame = open_row
+            elif open_row['timestamp'].iloc[0] > closed['timestamp'].iloc[-1]:
+                frame = pd.concat([closed, open_row], ignore_index=True)
+        _cache[level] = {'stat': stat, 'offset': offset, 'closed': closed, 'state_stat': state_stat,
+                         'frame': frame}
+        return frame
+
+
+if __name__ == "__main__":
+    rebuild_rollups()
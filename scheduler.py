@@ -0,0 +1,87 @@
+import math
+import random
+import time
+import metrics
+
+# constants
+# a job that fell behind by more ticks than this skips the rest, even when it catches up on missed ticks
+MAX_CATCH_UP_TICKS = 12
+# the loop wakes up at least this often, so a wall clock set forward or back is noticed (see run)
+MAX_SLEEP = 60
+OVERRUN_POLICIES = ('skip', 'catch_up')
+
+
+# a job of the scheduler: fn(tick) is called for every tick, the multiples of interval seconds since the
+# epoch shifted by offset, so the runs stay on the wall clock (e.g. on the full five minutes) however long
+# they take - jitter delays every run by a random part of that many seconds, so collectors started together
+# do not all call an API in the same second
+# overrun decides about the ticks that passed while a run was late: 'skip' them, or 'catch_up' on them
+# by running right away
+def new_job(name, fn, interval, offset=0, jitter=0, overrun='skip', run_at_start=False):
+    if overrun not in OVERRUN_POLICIES:
+        raise ValueError(f"Unknown overrun policy {overrun} of job {name}")
+    return {'name': name, 'fn': fn, 'interval': interval, 'offset': offset, 'jitter': jitter,
+            'overrun': overrun, 'run_at_start': run_at_start, 'tick': None, 'run_at': None}
+
+
+# first tick of a job after epoch
+def next_tick(job, after):
+    interval, offset = job['interval'], job['offset']
+    return (math.floor((after - offset) / interval) + 1) * interval + offset
+
+
+def _plan(job, tick, now):
+    job['tick'] = tick
+    job['run_at'] = tick + random.uniform(0, job['jitter']) if job['jitter'] and tick > now else tick
+
+
+# move a job to its tick after the one that just ran - a first run started right away is followed by
+# the first tick at least half an interval later
+def _advance(job, now):
+    tick = next_tick(job, job['tick'] + job['interval'] / 2)
+    if tick <= now:
+        missed = math.floor((now - tick) / job['interval']) + 1
+        if job['overrun'] == 'skip' or missed > MAX_CATCH_UP_TICKS:
+            metrics.inc('collector_scheduler_ticks_total', {'job': job['name'], 'result': 'skipped'}, missed)
+            tick = next_tick(job, now)
+    _plan(job, tick, now)
+
+
+def _run(job, clock):
+    started = clock()
+    metrics.set_gauge('collector_cycle_drift_seconds', started - job['tick'], {'job': job['name']})
+    try:
+        job['fn'](job['tick'])
+    except Exception as e:
+        print(f"Error running {job['name']}: {e}")
+    metrics.inc('collector_scheduler_ticks_total', {'job': job['name'], 'result': 'run'})
+
+
+# plan the jobs again from now after the wall clock was set back: a job planned more than an interval
+# ahead would otherwise wait for the time it lost, e.g. an hour without samples after an hour's correction
+def _replan(jobs, now, went_back):
+    for job in jobs:
+        if went_back or job['run_at'] - now > job['interval'] + job['jitter']:
+            _plan(job, next_tick(job, now), now)
+
+
+# run the jobs on their ticks, one at a time and the earliest first, until stop (a threading.Event) is set
+def run(jobs, stop=None, clock=time.time):
+    now = clock()
+    for job in jobs:
+        _plan(job, now if job['run_at_start'] else next_tick(job, now), now)
+    last = now
+    while stop is None or not stop.is_set():
+        now = clock()
+        _replan(jobs, now, now < last)
+        last = now
+        job = min(jobs, key=lambda job: job['run_at'])
+        delay = job['run_at'] - now
+        if delay > 0:
+            if stop is None:
+                time.sleep(min(delay, MAX_SLEEP))
+            else:
+                stop.wait(min(delay, MAX_SLEEP))
+            continue
+        _run(job, clock)
+        _advance(job, clock())
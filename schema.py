@@ -0,0 +1,64 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytz
+import registry
+
+# constants
+ATHENS_TZ = pytz.timezone('Europe/Athens')
+# dtypes of the samples held in memory: readings as float32, which is plenty for sensors reporting a tenth
+# of a degree, and cloudiness and humidity percentages in a byte - nullable, as the weather may be missing
+# the timestamps stay datetime64, an int64 of epoch nanoseconds that the app slices and plots directly
+SAMPLE_DTYPES = {**dict.fromkeys(registry.SENSOR_COLUMNS, 'float32'),
+                 'current_cloudiness': 'UInt8', 'current_temp': 'float32', 'current_humidity': 'UInt8',
+                 'three_day_forecast_avg': 'float32'}
+# sunrise and sunset only change once a day, so they are kept in a side table with a row per day
+SUN_COLUMNS = {'current_sunrise': 'sunrise', 'current_sunset': 'sunset'}
+SUN_DTYPE = f"datetime64[ns, {ATHENS_TZ.zone}]"
+
+
+# a sun table without days
+def empty_sun():
+    return pd.DataFrame({col: pd.Series(dtype=SUN_DTYPE) for col in SUN_COLUMNS.values()},
+                        index=pd.DatetimeIndex([], tz=ATHENS_TZ, name='day'))
+
+
+# a reported sunrise or sunset at the same time of day on day - the api reports them around the time of
+# the request, which may belong to a neighbouring day close to midnight
+def _on_day(day, reported):
+    wall_time = pd.Timestamp(reported).tz_convert(ATHENS_TZ).time()
+    return ATHENS_TZ.localize(datetime.combine(day.date(), wall_time))
+
+
+# sunrise and sunset of every day of a frame of raw samples, from the last sample of the day that has them -
+# the raw columns hold iso strings (store) or datetimes (feed)
+def sun_table(df):
+    present = np.logical_and.reduce([df[col].notna().to_numpy() for col in SUN_COLUMNS])
+    days = df['timestamp'][present].dt.normalize()
+    last = ~days.duplicated(keep='last').to_numpy()
+    if not last.any():
+        return empty_sun()
+    days, reported = days[last], df.iloc[np.flatnonzero(present)[last]]
+    table = {name: [_on_day(day, time) for day, time in zip(days, reported[col])] for col, name in SUN_COLUMNS.items()}
+    return pd.DataFrame(table, index=pd.DatetimeIndex(days, name='day')).astype(SUN_DTYPE)
+
+
+# one sun table from the tables of several pieces of samples, a later table wins for a day in both
+def merge_sun(tables):
+    tables = [table for table in tables if not table.empty]
+    if not tables:
+        return empty_sun()
+    if len(tables) == 1:
+        return tables[0]
+    return pd.concat(tables).groupby(level=0).last()
+
+
+# split a frame of raw samples (see storage.parse_rows) into the samples in the compact dtypes, without
+# the sunrise and sunset, and their sun table
+def compact(df):
+    # built column by column, much faster than astype for the small frames of single days
+    columns = {'timestamp': df['timestamp'].array}
+    for col, dtype in SAMPLE_DTYPES.items():
+        values = df[col].to_numpy(dtype=float)
+        columns[col] = pd.array(values.round(), dtype=dtype) if dtype == 'UInt8' else values.astype(dtype)
+    return pd.DataFrame(columns, index=df.index, copy=False), sun_table(df)
@@ -0,0 +1,318 @@
+import csv
+import io
+import json
+import math
+import os
+import threading
+from datetime import datetime
+import pandas as pd
+import pytz
+import registry
+import schema
+
+# constants
+ATHENS_TZ = pytz.timezone('Europe/Athens')
+# directory of the site this process serves, see registry.py
+DATA_DIR = registry.DATA_DIR
+# single-file csv the site was stored in before the day segments, None for a site that never had one
+LEGACY_CSV_FILE = registry.SITE['legacy_csv']
+SENSOR_COLUMNS = registry.SENSOR_COLUMNS
+COLUMNS = ['timestamp', *SENSOR_COLUMNS,
+           'current_cloudiness', 'current_temp', 'current_humidity',
+           'current_sunrise', 'current_sunset', 'three_day_forecast_avg']
+
+# the store is a directory of day segments named after the local (Athens) date:
+#   YYYY-MM-DD.csv      append-only log for a day that is still being written
+#   YYYY-MM-DD.parquet  compacted, immutable segment for a finished day
+LOG_SUFFIX = '.csv'
+SEGMENT_SUFFIX = '.parquet'
+
+# process-wide cache shared by every dashboard session, holding the samples in the compact schema.py dtypes:
+#   'files'  path -> {'stat': (size, mtime), 'offset': bytes parsed, 'rows': rows in frame}
+#   'frame'  all cached rows, ordered by day, days laid out in the same order as 'files'
+#   'sun'    sunrise and sunset of every day, see schema.sun_table
+_cache_lock = threading.Lock()
+_cache = {'files': {}, 'frame': None, 'sun': schema.empty_sun()}
+
+
+def _day_path(day, suffix):
+    return os.path.join(DATA_DIR, f"{day}{suffix}")
+
+
+# list the days in the store, preferring the compacted segment when a day has both files
+def _list_days():
+    if not os.path.isdir(DATA_DIR):
+        return {}
+    days = {}
+    for name in sorted(os.listdir(DATA_DIR)):
+        day, suffix = os.path.splitext(name)
+        if suffix == SEGMENT_SUFFIX or (suffix == LOG_SUFFIX and day not in days):
+            days[day] = os.path.join(DATA_DIR, name)
+    return days
+
+
+# true for the empty values of sensors whose board did not answer
+def is_missing(value):
+    return value is None or value == '' or (isinstance(value, float) and math.isnan(value))
+
+
+# convert raw csv rows into the typed frame used by the app
+def parse_rows(df, columns=COLUMNS):
+    df = df.reindex(columns=columns)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True, format='ISO8601')
+    df['timestamp'] = df['timestamp'].dt.tz_convert(ATHENS_TZ)
+    return df
+
+
+# read the complete lines of a csv log from offset on, ignoring a trailing line that is still being written
+# returns the parsed rows and the number of bytes consumed
+def read_log_lines(path, offset=0, columns=COLUMNS):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        content = f.read()
+    content = content[:content.rfind(b'\n') + 1]
+    if not content:
+        return parse_rows(pd.DataFrame(columns=columns), columns), 0
+    if offset:
+        rows = pd.read_csv(io.BytesIO(content), header=None, names=columns)
+    else:
+        rows = pd.read_csv(io.BytesIO(content))
+    return parse_rows(rows, columns), len(content)
+
+
+def _read_log(path):
+    return read_log_lines(path)[0]
+
+
+# read a whole day, returning the frame and the number of bytes consumed
+def _read_day(path):
+    if path.endswith(SEGMENT_SUFFIX):
+        df = pd.read_parquet(path)
+        # segments written before sensors were added to or removed from the site
+        if list(df.columns) != COLUMNS:
+            df = df.reindex(columns=COLUMNS)
+        return df, 0
+    df, offset = read_log_lines(path)
+    return df.sort_values('timestamp', ignore_index=True), offset
+
+
+# load a small json state file, returning default when it is missing or unreadable
+def load_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+# replace a small json state file atomically, so a crash never leaves it half-written
+def save_json(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# append a single sample to the log of its day - O(1) regardless of history size
+# the day logs are the journal of the collector: a sample is safe from a power cut once this returns,
+# everything derived from it can be recomputed from the logs (see journal.py)
+def append_sample(data):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = _day_path(data['timestamp'][:10], LOG_SUFFIX)
+    is_new = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+        if is_new:
+            writer.writeheader()
+        writer.writerow(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# cut a line that was still being written when the power went off from the end of a csv log, so the next
+# line appended does not continue it - a log without a single complete line is removed
+def repair_log(path):
+    with open(path, 'r+b') as f:
+        content = f.read()
+        end = content.rfind(b'\n') + 1
+        if end < len(content):
+            print(f"Error in {path}: dropping {len(content) - end} bytes of an incomplete line")
+            f.truncate(end)
+    if end == 0:
+        os.remove(path)
+
+
+# repair the day logs, see repair_log
+def repair_logs():
+    for path in _list_days().values():
+        if path.endswith(LOG_SUFFIX):
+            repair_log(path)
+
+
+# turn the logs of finished days into parquet segments
+def compact_segments():
+    if not os.path.isdir(DATA_DIR):
+        return 0
+    today = datetime.now(ATHENS_TZ).date().isoformat()
+    compacted = 0
+    for name in sorted(os.listdir(DATA_DIR)):
+        day, suffix = os.path.splitext(name)
+        if suffix != LOG_SUFFIX or day >= today:
+            continue
+        path = os.path.join(DATA_DIR, name)
+        segment_path = _day_path(day, SEGMENT_SUFFIX)
+        df = _read_log(path)
+        # a segment may already exist if we were interrupted between writing it and removing the log,
+        # or if a late sample reopened the day - merge them without duplicating rows
+        if os.path.exists(segment_path):
+            df = pd.concat([pd.read_parquet(segment_path), df], ignore_index=True)
+            df = df.drop_duplicates('timestamp').sort_values('timestamp', ignore_index=True)
+        tmp_path = segment_path + '.tmp'
+        df.to_parquet(tmp_path, index=False)
+        # the log is removed next, so the segment must be on disk first
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, segment_path)
+        os.remove(path)
+        compacted += 1
+    return compacted
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+# remember where each file's rows start in the new cached frame
+def _store(files, frame, sun):
+    start = 0
+    for entry in files.values():
+        entry['start'] = start
+        start += entry['rows']
+    _cache['files'], _cache['frame'], _cache['sun'] = files, frame, sun
+    return frame
+
+
+# rows of a file as they are currently held in the cached frame
+def _cached_rows(path, entry):
+    return _cache['frame'].iloc[entry['start']:entry['start'] + entry['rows']]
+
+
+# bring the cache up to date with the files on disk, only parsing what changed since the last call
+def _refresh_cache():
+    old_files, old_frame = _cache['files'], _cache['frame']
+
+    # pieces holds None for a day whose cached rows are kept, days read in full are listed in read
+    files, pieces, read, suns, reparsed, appended = {}, [], [], [_cache['sun']], False, []
+    for path in _list_days().values():
+        entry = old_files.get(path)
+        try:
+            stat = _stat(path)
+        except FileNotFoundError:
+            # the log was compacted while we were listing, read the segment instead
+            path = path[:-len(LOG_SUFFIX)] + SEGMENT_SUFFIX
+            stat = _stat(path)
+            entry = None
+
+        if entry and entry['stat'] == stat:
+            piece = None
+        elif entry and path.endswith(LOG_SUFFIX) and stat[0] > entry['offset']:
+            # the log only grew - parse the new tail and keep the rows we already have
+            tail, consumed = read_log_lines(path, entry['offset'])
+            piece = None
+            if not tail.empty:
+                tail, tail_sun = schema.compact(tail)
+                suns.append(tail_sun)
+                piece = pd.concat([_cached_rows(path, entry), tail], ignore_index=True)
+                if piece['timestamp'].is_monotonic_increasing:
+                    appended.append((path, tail))
+                else:
+                    # e.g. the clock was set back - keep the day sorted and rebuild the frame
+                    piece = piece.sort_values('timestamp', ignore_index=True)
+                    reparsed = True
+            entry = {'stat': stat, 'offset': entry['offset'] + consumed, 'rows': entry['rows'] + len(tail)}
+        else:
+            piece, offset = _read_day(path)
+            read.append(len(pieces))
+            entry = {'stat': stat, 'offset': offset, 'rows': len(piece)}
+            reparsed = True
+        files[path] = dict(entry)
+        pieces.append(piece)
+
+    if old_frame is not None and not reparsed and list(files) == list(old_files):
+        if not appended:
+            return _store(files, old_frame, _cache['sun'])
+        if len(appended) == 1 and appended[0][0] == list(files)[-1]:
+            # common case: a few rows were appended to the newest day
+            return _store(files, pd.concat([old_frame, appended[0][1]], ignore_index=True), schema.merge_sun(suns))
+
+    # the days read in full are brought into the compact dtypes together, which saves the constant cost
+    # of doing it for every day - e.g. on the first load
+    if read:
+        compacted, sun = schema.compact(pd.concat([pieces[index] for index in read], ignore_index=True))
+        suns.append(sun)
+        if len(read) == len(pieces):
+            return _store(files, compacted, schema.merge_sun(suns))
+        start = 0
+        for index in read:
+            rows = len(pieces[index])
+            pieces[index] = compacted.iloc[start:start + rows]
+            start += rows
+
+    # rebuild the frame, reusing the rows of unchanged days
+    pieces = [_cached_rows(path, old_files[path]) if piece is None else piece
+              for path, piece in zip(files, pieces)]
+    pieces = [piece for piece in pieces if not piece.empty]
+    if pieces:
+        frame = pd.concat(pieces, ignore_index=True)
+    else:
+        frame = schema.compact(parse_rows(pd.DataFrame(columns=COLUMNS)))[0]
+    return _store(files, frame, schema.merge_sun(suns))
+
+
+# load all stored samples, sorted by timestamp, in the dtypes of schema.py and without the sunrise and
+# sunset (see load_sun) - the returned frame is shared between callers and must not be modified
+def load_samples():
+    with _cache_lock:
+        df = _refresh_cache()
+    if df.empty:
+        return pd.DataFrame()
+    return df
+
+
+# sunrise and sunset of every day of the samples last returned by load_samples, a frame indexed by day
+def load_sun():
+    with _cache_lock:
+        return _cache['sun']
+
+
+# one-shot migration of the old single-file csv into day segments - a csv whose sensors are not the ones of
+# the site is left alone, its readings would all be lost to the columns of the site
+def migrate_csv(csv_file=LEGACY_CSV_FILE):
+    if not csv_file or not os.path.exists(csv_file):
+        return 0
+    header = pd.read_csv(csv_file, nrows=0).columns
+    sensors = [col for col in header if col not in ['timestamp', *registry.WEATHER_COLUMNS]]
+    if sorted(sensors) != sorted(SENSOR_COLUMNS):
+        print(f"Not migrating {csv_file}: its sensor columns {', '.join(sensors)} are not the ones of site "
+              f"{registry.SITE_ID} ({', '.join(SENSOR_COLUMNS)})")
+        return 0
+    os.makedirs(DATA_DIR, exist_ok=True)
+    df = pd.read_csv(csv_file, dtype={'timestamp': str}).reindex(columns=COLUMNS)
+    days = parse_rows(df.copy())['timestamp'].dt.date.astype(str)
+
+    for day, rows in df.groupby(days, sort=True):
+        path = _day_path(day, LOG_SUFFIX)
+        rows.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+    compact_segments()
+    os.replace(csv_file, csv_file + '.migrated')
+    print(f"Migrated {len(df)} rows from {csv_file} into {DATA_DIR}/")
+    return len(df)
+
+
+if __name__ == "__main__":
+    migrate_csv()
@@ -0,0 +1,56 @@
+import scheduler
+
+
+# a clock the scheduler waits on without sleeping: waiting moves the time forward, a job may set it
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+        self.stopped = False
+
+    def __call__(self):
+        return self.now
+
+    def is_set(self):
+        return self.stopped
+
+    def wait(self, seconds):
+        self.now += seconds
+
+
+# run a job every interval seconds until it ran runs times, returning the times of its runs
+def run_job(clock, interval, runs, on_run=None):
+    ran = []
+
+    def fn(tick):
+        ran.append(clock())
+        if on_run:
+            on_run(len(ran))
+        clock.stopped = len(ran) >= runs
+    scheduler.run([scheduler.new_job('sample', fn, interval)], stop=clock, clock=clock)
+    return ran
+
+
+def test_runs_on_wall_clock_ticks():
+    clock = FakeClock(1000)
+    assert run_job(clock, 300, 3) == [1200, 1500, 1800]
+
+
+def test_clock_set_forward_skips_to_the_next_tick():
+    clock = FakeClock(1000)
+
+    def step_forward(runs):
+        if runs == 1:
+            clock.now += 3600
+    ran = run_job(clock, 300, 2, step_forward)
+    assert ran == [1200, 5100]
+
+
+def test_clock_set_back_is_noticed():
+    clock = FakeClock(1000)
+
+    # an ntp correction of an hour right after the first run
+    def step_back(runs):
+        if runs == 1:
+            clock.now -= 3600
+    ran = run_job(clock, 300, 3, step_back)
+    assert ran == [1200, -2100, -1800]
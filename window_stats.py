@@ -0,0 +1,52 @@
+import math
+import numpy as np
+import storage
+
+
+# accumulator of count, mean and sum of squared deviations, plus the extremes - the welford state persisted by
+# the collector is the one of every rollup bucket (see rollups.py), stats_from_rollup merges a window of them
+def new_accumulator():
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None}
+
+
+# sample standard deviation of an accumulator, like pandas' std()
+def accumulator_std(acc):
+    if acc['count'] < 2:
+        return float('nan')
+    return math.sqrt(acc['m2'] / (acc['count'] - 1))
+
+
+# statistics of a frame of raw samples in the accumulator format, computed in one vectorized pass
+def stats_from_samples(df):
+    stats = {}
+    for col in storage.SENSOR_COLUMNS:
+        # the loaded samples are float32, the statistics are summed in float64
+        values = df[col].dropna().astype(float) if col in df else []
+        acc = new_accumulator()
+        if len(values):
+            acc.update(count=len(values), mean=float(values.mean()), m2=float(values.var(ddof=0) * len(values)),
+                       min=float(values.min()), max=float(values.max()))
+        stats[col] = acc
+    return stats
+
+
+# statistics of a window from its rollup buckets, merging the per-bucket count/mean/std (Chan et al.)
+# so the cost depends on the number of buckets, not samples
+def stats_from_rollup(rollup):
+    stats = {}
+    for col in storage.SENSOR_COLUMNS:
+        acc = new_accumulator()
+        counts = rollup[f"{col}_count"].fillna(0).to_numpy(dtype=float) if len(rollup) else np.zeros(0)
+        present = counts > 0
+        if present.any():
+            counts = counts[present]
+            means = rollup[col].to_numpy(dtype=float)[present]
+            m2s = np.nan_to_num(rollup[f"{col}_std"].to_numpy(dtype=float)[present] ** 2) * (counts - 1)
+            count = counts.sum()
+            mean = (counts * means).sum() / count
+            acc.update(count=int(count), mean=float(mean),
+                       m2=float(m2s.sum() + (counts * (means - mean) ** 2).sum()),
+                       min=float(rollup[f"{col}_min"].min()), max=float(rollup[f"{col}_max"].max()))
+        stats[col] = acc
+    return stats
+